@@ -0,0 +1,205 @@
+from collections import defaultdict
+
+import argparse
+import gzip
+import json
+import math
+import os
+import re
+import sys
+
+# Per-customer latency from ALB access logs. Log files are streamed line by
+# line and every latency goes into a fixed-size quantile sketch, so memory
+# stays bounded no matter how many requests a day of logs holds.
+
+# Fields of an ALB access log entry, see
+# https://docs.aws.amazon.com/elasticloadbalancing/latest/application/load-balancer-access-logs.html
+FIELD = re.compile(r'"[^"]*"|\S+')
+REQUEST_PROCESSING_TIME = 5
+TARGET_PROCESSING_TIME = 6
+RESPONSE_PROCESSING_TIME = 7
+REQUEST = 12
+TARGET_GROUP_ARN = 16
+
+TIMINGS = (
+    ('request', REQUEST_PROCESSING_TIME),
+    ('target', TARGET_PROCESSING_TIME),
+    ('response', RESPONSE_PROCESSING_TIME),
+)
+QUANTILES = (50, 95, 99)
+
+
+class QuantileSketch(object):
+    # Log-bucketed histogram: every value is counted in the bucket
+    # (gamma^(k-1), gamma^k], so any quantile is returned within
+    # relative_accuracy of the true value. Buckets cover the whole range of
+    # request latencies in a few thousand entries; past max_buckets the
+    # lowest buckets are merged, giving up accuracy on the fastest requests
+    # first.
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048,
+                 min_value=1e-6):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+        self.buckets = defaultdict(int)
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= self.min_value:
+            self.zero_count += 1
+            return
+        self.buckets[int(math.ceil(math.log(value) / self.log_gamma))] += 1
+        if len(self.buckets) > self.max_buckets:
+            keys = sorted(self.buckets)
+            self.buckets[keys[1]] += self.buckets.pop(keys[0])
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q / 100.0 * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # Midpoint of the bucket, in relative terms
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class LatencyStats(object):
+
+    def __init__(self):
+        self.sketches = dict((name, QuantileSketch()) for name, _ in TIMINGS)
+        self.requests = 0
+
+    def add(self, fields):
+        self.requests += 1
+        for name, index in TIMINGS:
+            value = float(fields[index])
+            # -1 means the request never reached that stage
+            if value >= 0:
+                self.sketches[name].add(value)
+
+
+def log_lines(path):
+    # Streams every line of the .gz and plain log files under path
+    if os.path.isdir(path):
+        file_names = []
+        for directory, _, names in os.walk(path):
+            file_names.extend(os.path.join(directory, name) for name in names
+                              if name.endswith(('.log', '.gz')))
+        file_names.sort()
+    else:
+        file_names = [path]
+
+    for file_name in file_names:
+        opener = gzip.open if file_name.endswith('.gz') else open
+        with opener(file_name, 'rb') as log_file:
+            for line in log_file:
+                yield line.decode('utf-8', 'replace')
+
+
+def request_host(request):
+    # "GET https://client1.nimbus.com:443/api/1.0 HTTP/1.1" -> client1.nimbus.com
+    parts = request.strip('"').split(' ')
+    if len(parts) < 2 or '://' not in parts[1]:
+        return None
+    return parts[1].split('://', 1)[1].split('/', 1)[0].split(':')[0].lower()
+
+
+def target_group_name(arn):
+    # arn:aws:elasticloadbalancing:...:targetgroup/NMB-client1-webLayer/id
+    if arn == '-' or 'targetgroup/' not in arn:
+        return '-'
+    return arn.split('targetgroup/', 1)[1].split('/')[0]
+
+
+def analyze(lines, domain=None):
+    by_host = defaultdict(LatencyStats)
+    by_target_group = defaultdict(LatencyStats)
+    skipped = 0
+    suffix = '.' + domain.lower() if domain else None
+
+    for line in lines:
+        fields = FIELD.findall(line)
+        if len(fields) <= TARGET_GROUP_ARN:
+            skipped += 1
+            continue
+        try:
+            host = request_host(fields[REQUEST]) or '-'
+            # Hosts outside {cust}.{domain} (scanners, bare IPs) are pooled
+            # so they can't grow the report without bound
+            if suffix and not host.endswith(suffix):
+                host = '(other)'
+            by_host[host].add(fields)
+            by_target_group[target_group_name(fields[TARGET_GROUP_ARN])].add(
+                fields)
+        except ValueError:
+            skipped += 1
+
+    return by_host, by_target_group, skipped
+
+
+def summary(stats):
+    return dict(
+        (key, dict(
+            [('requests', value.requests)] +
+            [('%s_p%d' % (name, q), value.sketches[name].quantile(q))
+             for name, _ in TIMINGS for q in QUANTILES]
+        )) for key, value in stats.items()
+    )
+
+
+def format_table(title, stats):
+    lines = [title]
+    header = '  %-40s %9s' % ('', 'requests')
+    for name, _ in TIMINGS:
+        header += '  %-23s' % ('%s ms p50/p95/p99' % name)
+    lines.append(header)
+
+    def ms(value):
+        return '-' if value is None else '%.0f' % (value * 1000)
+
+    for key in sorted(stats, key=lambda k: (-stats[k].requests, k)):
+        value = stats[key]
+        line = '  %-40s %9d' % (key, value.requests)
+        for name, _ in TIMINGS:
+            line += '  %-23s' % '/'.join(
+                ms(value.sketches[name].quantile(q)) for q in QUANTILES)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Per-customer latency percentiles from ALB access logs.'
+    )
+    parser.add_argument('logs', help='directory of access log files '
+                                     '(.gz or .log) or a single file')
+    parser.add_argument('--domain',
+                        help='customer domain, e.g. nimbus.com; other hosts '
+                             'are reported together as (other)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the percentiles as JSON')
+    args = parser.parse_args()
+
+    by_host, by_target_group, skipped = analyze(log_lines(args.logs),
+                                                args.domain)
+    if args.json:
+        print(json.dumps({
+            'hosts': summary(by_host),
+            'target_groups': summary(by_target_group),
+            'skipped': skipped,
+        }, indent=4, sort_keys=True, separators=(',', ': ')))
+    else:
+        print(format_table('Per host', by_host))
+        print('')
+        print(format_table('Per target group', by_target_group))
+    if skipped:
+        sys.stderr.write('Skipped %d malformed lines\n' % skipped)
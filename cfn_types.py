@@ -0,0 +1,140 @@
+from troposphere import AWSObject, AWSProperty, Tags
+from troposphere.validators import boolean, floatingpoint, integer
+import troposphere.autoscaling as autoscaling
+
+# CloudFormation resource and property types, or properties of them, that
+# the troposphere release the generator runs on (2.0.2) doesn't have yet.
+# They follow the troposphere classes of the same name and render the same
+# JSON, so they can be swapped for the upstream ones once it has them.
+
+
+class PredictiveScalingPredefinedMetricPair(AWSProperty):
+    props = {
+        'PredefinedMetricType': (basestring, True),
+        'ResourceLabel': (basestring, False),
+    }
+
+
+class PredictiveScalingMetricSpecification(AWSProperty):
+    props = {
+        'PredefinedMetricPairSpecification': (
+            PredictiveScalingPredefinedMetricPair, False),
+        'TargetValue': (floatingpoint, True),
+    }
+
+
+class PredictiveScalingConfiguration(AWSProperty):
+    props = {
+        'MaxCapacityBreachBehavior': (basestring, False),
+        'MaxCapacityBuffer': (integer, False),
+        'MetricSpecifications': ([PredictiveScalingMetricSpecification],
+                                 True),
+        'Mode': (basestring, False),
+        'SchedulingBufferTime': (integer, False),
+    }
+
+
+class ScalingPolicy(autoscaling.ScalingPolicy):
+    props = dict(
+        autoscaling.ScalingPolicy.props,
+        PredictiveScalingConfiguration=(PredictiveScalingConfiguration, False),
+    )
+
+
+class ScheduledAction(autoscaling.ScheduledAction):
+    props = dict(
+        autoscaling.ScheduledAction.props,
+        TimeZone=(basestring, False),
+    )
+
+
+class CreditSpecification(AWSProperty):
+    props = {
+        'CpuCredits': (basestring, False),
+    }
+
+
+class IamInstanceProfile(AWSProperty):
+    props = {
+        'Arn': (basestring, False),
+        'Name': (basestring, False),
+    }
+
+
+class Monitoring(AWSProperty):
+    props = {
+        'Enabled': (boolean, False),
+    }
+
+
+class LaunchTemplateData(AWSProperty):
+    props = {
+        'CreditSpecification': (CreditSpecification, False),
+        'EbsOptimized': (boolean, False),
+        'IamInstanceProfile': (IamInstanceProfile, False),
+        'ImageId': (basestring, False),
+        'InstanceType': (basestring, False),
+        'KeyName': (basestring, False),
+        'Monitoring': (Monitoring, False),
+        'SecurityGroupIds': (list, False),
+        'UserData': (basestring, False),
+    }
+
+
+class LaunchTemplate(AWSObject):
+    resource_type = "AWS::EC2::LaunchTemplate"
+
+    props = {
+        'LaunchTemplateData': (LaunchTemplateData, True),
+        'LaunchTemplateName': (basestring, False),
+    }
+
+
+class LaunchTemplateSpecification(AWSProperty):
+    props = {
+        'LaunchTemplateId': (basestring, False),
+        'LaunchTemplateName': (basestring, False),
+        'Version': (basestring, True),
+    }
+
+
+class AutoScalingGroup(autoscaling.AutoScalingGroup):
+    props = dict(
+        autoscaling.AutoScalingGroup.props,
+        LaunchTemplate=(LaunchTemplateSpecification, False),
+    )
+
+    def validate(self):
+        # The upstream check only knows launch configurations and instances
+        if 'LaunchTemplate' not in self.properties:
+            return super(AutoScalingGroup, self).validate()
+        for name in ('LaunchConfigurationName', 'InstanceId'):
+            if name in self.properties:
+                raise ValueError("LaunchTemplate and %s are mutually "
+                                 "exclusive." % name)
+
+
+class DestinationOptions(AWSProperty):
+    props = {
+        'FileFormat': (basestring, True),
+        'HiveCompatiblePartitions': (boolean, True),
+        'PerHourPartition': (boolean, True),
+    }
+
+
+class FlowLog(AWSObject):
+    resource_type = "AWS::EC2::FlowLog"
+
+    props = {
+        'DeliverLogsPermissionArn': (basestring, False),
+        'DestinationOptions': (DestinationOptions, False),
+        'LogDestination': (basestring, False),
+        'LogDestinationType': (basestring, False),
+        'LogFormat': (basestring, False),
+        'LogGroupName': (basestring, False),
+        'MaxAggregationInterval': (integer, False),
+        'ResourceId': (basestring, True),
+        'ResourceType': (basestring, True),
+        'Tags': ((Tags, list), False),
+        'TrafficType': (basestring, False),
+    }
@@ -0,0 +1,316 @@
+import argparse
+import heapq
+import json
+import random
+
+import resource_graph
+
+# Offline estimate of stack create and update wall time. Resources are
+# scheduled on the dependency graph from resource_graph the way CloudFormation
+# does it: a resource starts as soon as everything it depends on is complete.
+# Each resource takes a duration drawn from a triangular distribution for its
+# type, and many runs give the spread of the deploy time. Updates also
+# replace the resources that reference a replaced resource where that
+# reference can't change in place, and end with the cleanup phase that
+# deletes removed and replaced resources.
+
+# Properties whose change replaces a resource, by type; None means any change
+# does. Changes to types not listed are made in place.
+REPLACEMENT_PROPERTIES = {
+    'AWS::AutoScaling::LaunchConfiguration': None,
+    'AWS::EC2::EIP': ('Domain',),
+    'AWS::EC2::FlowLog': None,
+    'AWS::EC2::Instance': ('AvailabilityZone', 'ImageId', 'KeyName',
+                           'NetworkInterfaces', 'SubnetId'),
+    'AWS::EC2::LaunchTemplate': ('LaunchTemplateName',),
+    'AWS::EC2::NatGateway': ('AllocationId', 'SubnetId'),
+    'AWS::EC2::PlacementGroup': None,
+    'AWS::EC2::Route': ('DestinationCidrBlock', 'RouteTableId'),
+    'AWS::EC2::RouteTable': ('VpcId',),
+    'AWS::EC2::SecurityGroup': ('GroupDescription', 'GroupName', 'VpcId'),
+    'AWS::EC2::Subnet': ('AvailabilityZone', 'CidrBlock', 'VpcId'),
+    'AWS::EC2::VPC': ('CidrBlock', 'InstanceTenancy'),
+    'AWS::ElasticLoadBalancingV2::Listener': ('LoadBalancerArn',),
+    'AWS::ElasticLoadBalancingV2::ListenerRule': ('ListenerArn',),
+    'AWS::ElasticLoadBalancingV2::LoadBalancer': ('Name', 'Scheme', 'Type'),
+    'AWS::ElasticLoadBalancingV2::TargetGroup': ('Name', 'Port', 'Protocol',
+                                                 'TargetType', 'VpcId'),
+    'AWS::IAM::InstanceProfile': ('InstanceProfileName', 'Path'),
+    'AWS::IAM::Role': ('Path', 'RoleName'),
+    'AWS::RDS::DBInstance': ('AvailabilityZone', 'DBInstanceIdentifier',
+                             'DBName', 'DBSubnetGroupName', 'Engine',
+                             'KmsKeyId', 'MasterUsername', 'StorageEncrypted'),
+    'AWS::RDS::DBSubnetGroup': ('DBSubnetGroupName',),
+    'AWS::S3::Bucket': ('BucketName',),
+    'AWS::SSM::Parameter': ('Name',),
+}
+
+
+def load_durations(file_name=None):
+    # Overrides use the same shape as resource_graph.DEFAULT_DURATIONS, e.g.
+    # {"AWS::RDS::DBInstance": {"create": [900, 1200, 1800]}}
+    durations = dict(
+        (resource_type, dict(entry))
+        for resource_type, entry in resource_graph.DEFAULT_DURATIONS.items()
+    )
+    # Keys without '::' name a single resource, e.g. a nested stack whose
+    # time was estimated from its own template
+    if file_name:
+        with open(file_name) as durations_file:
+            for key, entry in json.load(durations_file).items():
+                durations.setdefault(key, {}).update(
+                    (action, tuple(value)) for action, value in entry.items()
+                )
+    return durations
+
+
+def resource_duration_range(durations, name, resource, action):
+    key = name if name in durations else resource['Type']
+    return resource_graph.duration_range(durations, key, action)
+
+
+def replaces(resource_type, properties):
+    replacing = REPLACEMENT_PROPERTIES.get(resource_type, ())
+    if replacing is None:
+        return bool(properties)
+    return any(name in replacing for name in properties)
+
+
+def update_plan(old_template, new_template):
+    # Returns the added, updated (in place or replaced), replaced and deleted
+    # resources of an update. A replaced resource gets a new physical ID, so
+    # every resource referencing it is updated as well, and replaced too when
+    # the referencing property can't change in place.
+    old = old_template.get('Resources', {})
+    new = new_template.get('Resources', {})
+    added = set(name for name in new if name not in old)
+    updated = set()
+    replaced = set()
+
+    for name in new:
+        if name in added or old[name] == new[name]:
+            continue
+        updated.add(name)
+        old_properties = old[name].get('Properties', {})
+        new_properties = new[name].get('Properties', {})
+        changed = [key for key in set(old_properties) | set(new_properties)
+                   if old_properties.get(key) != new_properties.get(key)]
+        if old[name]['Type'] != new[name]['Type'] or \
+                replaces(new[name]['Type'], changed):
+            replaced.add(name)
+
+    dependents = dict((name, []) for name in new)
+    for name, deps in resource_graph.build_graph(new_template).items():
+        for dep in deps:
+            dependents[dep].append(name)
+
+    pending = sorted(replaced)
+    while pending:
+        dep = pending.pop()
+        for name in dependents[dep]:
+            if name in added:
+                continue
+            properties = new[name].get('Properties', {})
+            referencing = [
+                key for key, value in properties.items()
+                if dep in resource_graph.references(value, set())
+            ]
+            # A DependsOn alone doesn't change the resource
+            if not referencing:
+                continue
+            updated.add(name)
+            if name not in replaced and replaces(new[name]['Type'],
+                                                 referencing):
+                replaced.add(name)
+                pending.append(name)
+
+    deleted = set(name for name in old if name not in new) | replaced
+    return added, updated, replaced, deleted
+
+
+def cleanup_graph(old_template, deleted):
+    # Resources are deleted after everything that depended on them
+    graph = resource_graph.build_graph(old_template)
+    reverse = dict((name, set()) for name in graph)
+    for name, deps in graph.items():
+        for dep in deps:
+            reverse[dep].add(name)
+    return dict((name, reverse[name] & deleted) for name in deleted)
+
+
+def schedule(graph, duration, max_parallel=None):
+    # Event-driven list scheduling. Returns the finish time of the last
+    # resource; resources not in duration are treated as already complete.
+    if max_parallel is not None and max_parallel < 1:
+        raise ValueError('max_parallel must be at least 1')
+    waiting = {}
+    dependents = dict((name, []) for name in graph)
+    for name in duration:
+        waiting[name] = len([dep for dep in graph[name] if dep in duration])
+        for dep in graph[name]:
+            if dep in duration:
+                dependents[dep].append(name)
+
+    ready = sorted(name for name, count in waiting.items() if count == 0)
+    running = []
+    now = 0.0
+    finished = 0
+    while finished < len(duration):
+        while ready and (max_parallel is None or len(running) < max_parallel):
+            name = ready.pop(0)
+            heapq.heappush(running, (now + duration[name], name))
+        now, name = heapq.heappop(running)
+        finished += 1
+        for dependent in dependents[name]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+    return now
+
+
+def simulate(template, durations, runs=200, old_template=None,
+             max_parallel=None, seed=0):
+    graph = resource_graph.build_graph(template)
+    resources = template.get('Resources', {})
+    replaced = set()
+    deleted = set()
+    if old_template is None:
+        action = 'create'
+        pending = set(resources)
+        created = pending
+    else:
+        action = 'update'
+        created, updated, replaced, deleted = update_plan(old_template,
+                                                          template)
+        pending = created | updated
+        old = old_template.get('Resources', {})
+
+    # Added and replaced resources are created, the others updated in place
+    ranges = dict(
+        (name, resource_duration_range(
+            durations, name, resources[name],
+            'create' if name in created or name in replaced else action))
+        for name in pending
+    )
+    cleanup = {}
+    cleanup_ranges = {}
+    if deleted:
+        cleanup = cleanup_graph(old_template, deleted)
+        cleanup_ranges = dict(
+            (name, resource_duration_range(durations, name, old[name],
+                                           'delete'))
+            for name in deleted
+        )
+
+    def draw(rng, item_ranges):
+        return dict((name, rng.triangular(low, high, mode))
+                    for name, (low, mode, high) in item_ranges.items())
+
+    rng = random.Random(seed)
+    times = []
+    cleanup_times = []
+    for _ in range(runs):
+        deploy = schedule(graph, draw(rng, ranges), max_parallel)
+        if cleanup:
+            cleanup_times.append(schedule(cleanup, draw(rng, cleanup_ranges),
+                                          max_parallel))
+        else:
+            cleanup_times.append(0.0)
+        times.append(deploy + cleanup_times[-1])
+    times.sort()
+    cleanup_times.sort()
+
+    # Typical deploy: every resource takes its typical time, scheduled under
+    # the same max_parallel as the simulated runs
+    typical = dict((name, float(mode)) for name, (_, mode, _) in ranges.items())
+    total = schedule(graph, typical, max_parallel)
+    if cleanup:
+        total += schedule(cleanup, dict(
+            (name, float(mode))
+            for name, (_, mode, _) in cleanup_ranges.items()
+        ), max_parallel)
+    _, path = resource_graph.critical_path(graph, dict(
+        (name, typical.get(name, 0.0)) for name in graph))
+    path = [name for name in path if name in pending]
+    return {
+        'action': action,
+        'resources': len(pending),
+        'replaced': sorted(replaced),
+        'deleted': len(deleted),
+        'typical': total,
+        'p50': percentile(times, 50),
+        'p90': percentile(times, 90),
+        'max': times[-1] if times else 0.0,
+        'cleanup_p50': percentile(cleanup_times, 50),
+        'critical_path': path,
+    }
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    index = int(round((len(values) - 1) * pct / 100.0))
+    return values[index]
+
+
+def minutes(seconds):
+    return '%d:%02d' % (int(seconds) // 60, int(seconds) % 60)
+
+
+def positive_integer(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return number
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Estimate CloudFormation create or update time of '
+                    'rendered templates without calling AWS.'
+    )
+    parser.add_argument('templates', nargs='+', metavar='TEMPLATE',
+                        help='rendered template JSON; several are compared')
+    parser.add_argument('--update-from', metavar='TEMPLATE',
+                        help='estimate an update from this deployed template '
+                             'instead of a create')
+    parser.add_argument('--durations', metavar='FILE',
+                        help='JSON file overriding per-type or per-resource '
+                             'durations')
+    parser.add_argument('--runs', type=positive_integer, default=200,
+                        help='number of simulated deploys (default: 200)')
+    parser.add_argument('--max-parallel', type=positive_integer, default=None,
+                        help='limit on resources in progress at once')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    durations = load_durations(args.durations)
+    old_template = None
+    if args.update_from:
+        with open(args.update_from) as template_file:
+            old_template = json.load(template_file)
+
+    print('%-40s %6s %9s %7s %7s %7s' % (
+        'template', 'action', 'resources', 'typical', 'p50', 'p90'))
+    results = []
+    for file_name in args.templates:
+        with open(file_name) as template_file:
+            template = json.load(template_file)
+        result = simulate(template, durations, args.runs, old_template,
+                          args.max_parallel, args.seed)
+        results.append((file_name, result))
+        print('%-40s %6s %9d %7s %7s %7s' % (
+            file_name, result['action'], result['resources'],
+            minutes(result['typical']), minutes(result['p50']),
+            minutes(result['p90'])))
+
+    for file_name, result in results:
+        print('')
+        print('%s critical path: %s' % (
+            file_name, ' -> '.join(result['critical_path']) or '(nothing)'))
+        if result['replaced']:
+            print('%s replaces: %s' % (file_name,
+                                       ', '.join(result['replaced'])))
+        if result['deleted']:
+            print('%s cleanup deletes %d resources, p50 %s' % (
+                file_name, result['deleted'], minutes(result['cleanup_p50'])))
@@ -12,949 +12,1858 @@ from troposphere.ec2 import SubnetRouteTableAssociation
 from troposphere.ec2 import VPCGatewayAttachment
 from troposphere.ec2 import Subnet
 from troposphere.ec2 import InternetGateway, NatGateway
-from troposphere.ec2 import Instance
+from troposphere.ec2 import Instance, PlacementGroup
 from troposphere.ec2 import VPC
 import troposphere.autoscaling as autoscaling
 import troposphere.elasticloadbalancingv2 as elb
+import troposphere.iam as iam
 import troposphere.route53 as route53
+import troposphere.ssm as ssm
 from troposphere.cloudwatch import Alarm, MetricDimension
 from troposphere.rds import DBInstance, DBSubnetGroup
 
+from troposphere.policies import AutoScalingScheduledAction, UpdatePolicy
+
+import argparse
+import cfn_types
+import itertools
 import json
+import math
+import multiprocessing
+import os
+import re
+import resource_graph
+import sys
+import template_report
+import time
 import yaml
 
-# Load input json
-
-with open('spec-prod.json') as spec_file:    
-    spec = json.load(spec_file)
-
-t = Template()
+# Spec loading
+
+def load_spec(file_name):
+    with open(file_name) as spec_file:
+        return json.load(spec_file)
+
+def merge_spec(base, overlay):
+    # Nested objects are merged key by key, any other overlay value replaces
+    # the base value (lists included).
+    merged = dict(base)
+    for key, value in overlay.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_spec(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+# Sample overlays mark values every deployment has to fill in
+PLACEHOLDER = "REPLACE-ME"
+
+def placeholder_values(spec, path=""):
+    # Dotted paths of every string in the spec still holding PLACEHOLDER
+    found = []
+    if isinstance(spec, dict):
+        for key in sorted(spec):
+            found.extend(placeholder_values(spec[key],
+                                            path + "." + key if path else key))
+    elif isinstance(spec, list):
+        for i, item in enumerate(spec):
+            found.extend(placeholder_values(item, "%s[%d]" % (path, i)))
+    elif isinstance(spec, basestring) and PLACEHOLDER in spec:
+        found.append(path)
+    return found
+
+# The region part of an Availability Zone name, also for Local and Wavelength
+# Zones: us-east-1a, us-west-2-lax-1a, us-east-1-wl1-bos-wlz-1
+AVAILABILITY_ZONE_REGION = re.compile(r'^([a-z]+(?:-[a-z]+)+-[0-9]+)')
+
+def spec_region(spec):
+    az = spec["project"]["az1"]
+    match = AVAILABILITY_ZONE_REGION.match(az)
+    if not match:
+        raise ValueError("project.az1 %s is not an Availability Zone name"
+                         % az)
+    return match.group(1)
+
+def priorities_file_name(spec_file_name):
+    return os.path.splitext(spec_file_name)[0] + '-priorities.json'
+
+def shards_file_name(spec_file_name):
+    return os.path.splitext(spec_file_name)[0] + '-shards.json'
+
+def stack_key(spec):
+    # The deployed stack a spec renders, e.g. NMB/Production/ca-central-1.
+    # A single-spec render and the overlay variant resolving to the same
+    # stack share the key, and so its records.
+    return "/".join([spec["project"]["tag"], spec["project"]["env"],
+                     spec_region(spec)])
+
+def vpc_cidr_range(vpc_cidr):
+    # First and last address of the VPC as integers. The subnet defaults are
+    # the first six /24 blocks of the VPC, which need at least a /21; AWS
+    # allows nothing wider than a /16. The address must be the network address
+    # itself, so the subnets start at the block AWS actually allocates.
+    try:
+        address, prefix = vpc_cidr.split("/")
+        octets = [int(octet) for octet in address.split(".")]
+        prefix = int(prefix)
+    except ValueError:
+        raise ValueError("project.vpc_cidr %s is not a CIDR block" % vpc_cidr)
+    if len(octets) != 4 or not all(0 <= octet <= 255 for octet in octets):
+        raise ValueError("project.vpc_cidr %s is not a CIDR block" % vpc_cidr)
+    if not 16 <= prefix <= 21:
+        raise ValueError("project.vpc_cidr %s must be a /16 to /21 to hold "
+                         "the six /24 subnets" % vpc_cidr)
+    first = octets[0] << 24 | octets[1] << 16 | octets[2] << 8 | octets[3]
+    size = 1 << (32 - prefix)
+    network = first & ~(size - 1)
+    if first != network:
+        raise ValueError("project.vpc_cidr %s has host bits set, the block is "
+                         "%d.%d.%d.%d/%d" % (vpc_cidr, network >> 24,
+                                             network >> 16 & 255,
+                                             network >> 8 & 255,
+                                             network & 255, prefix))
+    return first, first + size - 1
+
+def subnet_cidr(vpc_cidr, index):
+    # The index-th /24 of the VPC, e.g. ("10.0.0.0/16", 2) -> "10.0.2.0/24"
+    address = vpc_cidr_range(vpc_cidr)[0] + index * 256
+    return "%d.%d.%d.0/24" % (address >> 24, address >> 16 & 255,
+                              address >> 8 & 255)
+
+# Listener rule priorities
+
+def allocate_listener_priorities(customers, allocation_file):
+    # Every customer owns a slot n that is recorded in allocation_file; its api
+    # rule gets priority 2n-1 and its web rule 2n, so the more specific /api/*
+    # rule is evaluated first. Slots never move once allocated and slots of
+    # removed customers stay reserved, so adding or removing a customer only
+    # touches that customer's listener rules.
+    allocations = {}
+    if os.path.exists(allocation_file):
+        with open(allocation_file) as f:
+            allocations = json.load(f)
+
+    used = set(allocations.values())
+    slot = 1
+    for cust in sorted(customers):
+        if cust in allocations:
+            continue
+        while slot in used:
+            slot += 1
+        allocations[cust] = slot
+        used.add(slot)
+
+    with open(allocation_file, 'w') as f:
+        json.dump(allocations, f, indent=4, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+
+    return allocations
+
+# Customer database shards
+
+def allocate_db_shards(spec, allocation_file):
+    # Maps every customer to the rds node (1-based, as in rds01) holding its
+    # database. customers.*.db_shard pins a customer to a node; the others
+    # keep the node recorded for the stack (see stack_key) in
+    # allocation_file, which holds the placements of every stack rendered
+    # from the same base spec, and new customers go, largest
+    # db_size first, to the node that ends up least full relative to its
+    # allocation_size. Recorded placements are never moved automatically since
+    # moving a customer means migrating its data.
+    if not spec["rds"]:
+        return {}
+
+    customers = spec["customers"]
+    num_nodes = int(spec["rds"]["num_nodes"])
+    capacity = [float(size)
+                for size in spec["rds"]["allocation_size"][:num_nodes]]
+
+    def db_size(cust):
+        return float(customers[cust].get("db_size", 1))
+
+    stacks = {}
+    if os.path.exists(allocation_file):
+        with open(allocation_file) as f:
+            stacks = json.load(f)
+    recorded = stacks.get(stack_key(spec), {})
+
+    allocations = {}
+    for cust in customers:
+        if "db_shard" in customers[cust]:
+            allocations[cust] = int(customers[cust]["db_shard"])
+        elif cust in recorded:
+            allocations[cust] = recorded[cust]
+    for cust, node in allocations.items():
+        if not 1 <= node <= num_nodes:
+            raise ValueError("customer %s is placed on rds node %d but there "
+                             "are only %d nodes" % (cust, node, num_nodes))
+
+    used = [0.0] * num_nodes
+    for cust, node in allocations.items():
+        used[node - 1] += db_size(cust)
+
+    pending = sorted((cust for cust in customers if cust not in allocations),
+                     key=lambda cust: (-db_size(cust), cust))
+    for cust in pending:
+        size = db_size(cust)
+        node = min(range(num_nodes),
+                   key=lambda n: ((used[n] + size) / capacity[n], n))
+        if used[node] + size > capacity[node]:
+            raise ValueError("customer %s (%s GB) doesn't fit on any rds node"
+                             % (cust, customers[cust].get("db_size", 1)))
+        allocations[cust] = node + 1
+        used[node] += size
+
+    stacks[stack_key(spec)] = allocations
+    with open(allocation_file, 'w') as f:
+        json.dump(stacks, f, indent=4, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+
+    return allocations
+
+# Traffic profile scaling
+
+TRAFFIC_PROFILE_DAYS = {
+    "weekday": [1, 2, 3, 4, 5],
+    "weekend": [0, 6],
+}
+
+def traffic_schedule(profile, tier):
+    # Turns the hourly load curves of the traffic profile into the capacity
+    # changes of one tier. Returns (day type, cron days, hour, minute,
+    # capacity) tuples; scale-outs are moved lead_minutes earlier so the
+    # instances are in service when the ramp starts, scale-ins happen on the
+    # hour.
+    settings = profile["tiers"][tier]
+    per_instance = float(settings["requests_per_instance"])
+    min_instances = int(settings.get("min_instances", 1))
+    max_instances = int(settings.get("max_instances", min_instances))
+    lead = int(profile.get("lead_minutes", 15))
+
+    capacities = {}
+    for day_type in sorted(TRAFFIC_PROFILE_DAYS):
+        if day_type not in profile:
+            continue
+        load = profile[day_type]
+        if len(load) != 24:
+            raise ValueError("traffic_profile.%s needs 24 hourly values"
+                             % day_type)
+        capacities[day_type] = [
+            max(min_instances,
+                min(max_instances, int(math.ceil(l / per_instance))))
+            for l in load
+        ]
+    day_types = dict((day, day_type)
+                     for day_type, days in TRAFFIC_PROFILE_DAYS.items()
+                     for day in days)
+
+    def action(day_type, days, hour, scale_out, capacity):
+        minutes = hour * 60
+        if scale_out:
+            minutes -= lead
+        if minutes < 0:
+            minutes += 24 * 60
+            days = [(day - 1) % 7 for day in days]
+        return (day_type, ",".join(str(d) for d in sorted(days)),
+                minutes // 60, minutes % 60, capacity)
+
+    schedule = []
+    for day_type in sorted(capacities):
+        capacity = capacities[day_type]
+        # Midnight is always set since the day before may be another day
+        # type. It is moved earlier only on days where it raises the capacity
+        # left by hour 23 of the day before; a day type missing from the
+        # profile keeps the capacity of the last day that had actions.
+        raising = []
+        other = []
+        for day in TRAFFIC_PROFILE_DAYS[day_type]:
+            previous = capacities.get(day_types[(day - 1) % 7], capacity)[23]
+            if capacity[0] > previous:
+                raising.append(day)
+            else:
+                other.append(day)
+        for days, scale_out in ((raising, True), (other, False)):
+            if days:
+                schedule.append(action(day_type, days, 0, scale_out,
+                                       capacity[0]))
+        for hour in range(1, 24):
+            if capacity[hour] == capacity[hour - 1]:
+                continue
+            schedule.append(action(day_type, TRAFFIC_PROFILE_DAYS[day_type],
+                                   hour, capacity[hour] > capacity[hour - 1],
+                                   capacity[hour]))
+    return schedule
+
+def add_traffic_scaling(t, profile, tier, asg, max_size):
+    # Scheduled actions for the expected load, plus a predictive scaling
+    # policy when the profile asks for one. Reactive step policies stay in
+    # place for load above the forecast. max_size is the group's MaxSize,
+    # which a scheduled MinSize/DesiredCapacity must not exceed.
+    max_instances = int(profile["tiers"][tier].get(
+        "max_instances", profile["tiers"][tier].get("min_instances", 1)))
+    if max_instances > max_size:
+        raise ValueError("traffic_profile.tiers.%s.max_instances (%d) is "
+                         "above the group's MaxSize (%d)"
+                         % (tier, max_instances, max_size))
+    for day_type, days, hour, minute, capacity in traffic_schedule(profile,
+                                                                   tier):
+        properties = dict(
+            AutoScalingGroupName=Ref(asg),
+            DesiredCapacity=capacity,
+            MinSize=capacity,
+            Recurrence="%d %d * * %s" % (minute, hour, days),
+        )
+        if "timezone" in profile:
+            properties["TimeZone"] = profile["timezone"]
+        t.add_resource(cfn_types.ScheduledAction(
+            "%sAsgSchedule%s%02d%02d" % (tier, day_type.capitalize(),
+                                         hour, minute),
+            **properties
+        ))
 
-t.add_description(spec["project"]["desc"])
+    # Stack updates must not reset the capacity set by a scheduled action
+    asg.UpdatePolicy = UpdatePolicy(
+        AutoScalingScheduledAction=AutoScalingScheduledAction(
+            IgnoreUnmodifiedGroupSizeProperties=True
+        )
+    )
 
-# tag variables
-resource_tag = spec["project"]["tag"]
-project_name = spec["project"]["name"]
-environment_name = spec["project"]["env"]
-ticket = spec["project"]["ticket"]
-availability_zone_1 = spec["project"]["az1"]
-availability_zone_2 = spec["project"]["az2"]
+    predictive = profile.get("predictive")
+    if predictive:
+        t.add_resource(cfn_types.ScalingPolicy(
+            "%sAsgPredictiveScaling" % tier,
+            AutoScalingGroupName=Ref(asg),
+            PolicyType="PredictiveScaling",
+            PredictiveScalingConfiguration=(
+                cfn_types.PredictiveScalingConfiguration(
+                    Mode=predictive.get("mode", "ForecastAndScale"),
+                    SchedulingBufferTime=int(profile.get("lead_minutes", 15)) * 60,
+                    MetricSpecifications=[
+                        cfn_types.PredictiveScalingMetricSpecification(
+                            TargetValue=float(predictive.get("target_cpu", 50)),
+                            PredefinedMetricPairSpecification=(
+                                cfn_types.PredictiveScalingPredefinedMetricPair(
+                                    PredefinedMetricType="ASGCPUUtilization"
+                                )
+                            ),
+                        )
+                    ],
+                )
+            ),
+        ))
 
-# params
+# Compute tier options
+
+# Instance families by capability, keyed on the part of the instance type
+# before the dot
+BURSTABLE_FAMILIES = ("t2", "t3", "t3a", "t4g")
+EBS_OPTIMIZED_UNSUPPORTED_FAMILIES = ("t1", "t2")
+ENA_FAMILIES = (
+    "a1", "c5", "c5a", "c5ad", "c5d", "c5n", "c6a", "c6g", "c6gd", "c6gn",
+    "c6i", "c6id", "c6in", "c7g", "c7i", "d3", "d3en", "f1", "g3", "g4ad",
+    "g4dn", "g5", "h1", "i3", "i3en", "i4i", "inf1", "m5", "m5a", "m5ad", "m5d",
+    "m5dn", "m5n", "m5zn", "m6a", "m6g", "m6gd", "m6i", "m6id", "m7g", "m7i",
+    "p3", "p3dn", "p4d", "r4", "r5", "r5a", "r5ad", "r5b", "r5d", "r5dn",
+    "r5n", "r6a", "r6g", "r6gd", "r6i", "r6id", "r7g", "r7i", "t3", "t3a",
+    "t4g", "x1", "x1e", "x2idn", "x2iedn", "z1d",
+)
+# Both Auto Scaling groups span the subnets of az1 and az2, and a cluster
+# placement group can't span Availability Zones
+PLACEMENT_STRATEGIES = ("spread", "partition")
+CREDIT_SPECIFICATIONS = ("standard", "unlimited")
+# Graviton (arm64) families; everything else is x86_64
+ARM64_FAMILIES = (
+    "a1", "c6g", "c6gd", "c6gn", "c7g", "c7gd", "c7gn", "g5g", "im4gn",
+    "is4gen", "m6g", "m6gd", "m7g", "m7gd", "r6g", "r6gd", "r7g", "r7gd",
+    "t4g", "x2gd",
+)
 
-vpcCidr_param = t.add_parameter(Parameter(
-    "VpcCidr",
-    Description="VPC CIDR",
-    Default="10.0.0.0/16",
-    Type="String",
+def tier_instance_options(t, tier, settings):
+    # Checks the placement, EBS, networking, credit and monitoring options of a
+    # compute tier against its instance type and returns the extra
+    # LaunchConfiguration and AutoScalingGroup properties they need.
+    instance_type = settings["ec2_instance_type"]
+    family = instance_type.split(".")[0]
+    launch_options = {}
+    group_options = {}
+
+    def invalid(message):
+        raise ValueError("%s: %s (%s)" % (tier, message, instance_type))
+
+    strategy = settings.get("placement_strategy")
+    if strategy:
+        if strategy == "cluster":
+            invalid("a cluster placement group can't span the two "
+                    "Availability Zones of the tier")
+        if strategy not in PLACEMENT_STRATEGIES:
+            invalid("placement_strategy must be one of %s"
+                    % ", ".join(PLACEMENT_STRATEGIES))
+        placement_group = t.add_resource(PlacementGroup(
+            tier + "PlacementGroup",
+            Strategy=strategy,
+        ))
+        group_options["PlacementGroup"] = Ref(placement_group)
+
+    if "ebs_optimized" in settings:
+        if settings["ebs_optimized"] and \
+                family in EBS_OPTIMIZED_UNSUPPORTED_FAMILIES:
+            invalid("instance type can't be EBS-optimized")
+        launch_options["EbsOptimized"] = bool(settings["ebs_optimized"])
+
+    if settings.get("enhanced_networking") and family not in ENA_FAMILIES:
+        invalid("instance type doesn't support ENA enhanced networking")
+
+    credit = settings.get("credit_specification")
+    if credit:
+        if credit not in CREDIT_SPECIFICATIONS:
+            invalid("credit_specification must be one of %s"
+                    % ", ".join(CREDIT_SPECIFICATIONS))
+        if family not in BURSTABLE_FAMILIES:
+            invalid("credit_specification only applies to burstable "
+                    "instance types")
+
+    if "detailed_monitoring" in settings:
+        launch_options["InstanceMonitoring"] = \
+            bool(settings["detailed_monitoring"])
+
+    return launch_options, group_options
+
+def add_launch_resource(t, tier, settings, **properties):
+    # Adds what the tier's instances are launched from and returns the
+    # AutoScalingGroup property pointing at it. properties are
+    # LaunchConfiguration properties. Launch configurations can't set CPU
+    # credits, so a tier with a credit_specification gets a launch template
+    # with the same settings instead.
+    credit = settings.get("credit_specification")
+    if not credit:
+        launch_configuration = t.add_resource(autoscaling.LaunchConfiguration(
+            tier + "EC2LaunchConfiguration",
+            **properties
+        ))
+        return {"LaunchConfigurationName": Ref(launch_configuration)}
+
+    data = dict(properties)
+    data["SecurityGroupIds"] = data.pop("SecurityGroups")
+    # The tiers run in private subnets, which don't assign public IPs
+    if data.pop("AssociatePublicIpAddress", False):
+        raise ValueError("%s: launch templates here don't assign public IPs"
+                         % tier)
+    if "InstanceMonitoring" in data:
+        data["Monitoring"] = cfn_types.Monitoring(
+            Enabled=data.pop("InstanceMonitoring"))
+    if "IamInstanceProfile" in data:
+        # Ref of an instance profile is its name
+        data["IamInstanceProfile"] = cfn_types.IamInstanceProfile(
+            Name=data["IamInstanceProfile"])
+    launch_template = t.add_resource(cfn_types.LaunchTemplate(
+        tier + "EC2LaunchTemplate",
+        LaunchTemplateData=cfn_types.LaunchTemplateData(
+            CreditSpecification=cfn_types.CreditSpecification(
+                CpuCredits=credit
+            ),
+            **data
+        )
     ))
-
-natGatewayCidr_param = t.add_parameter(Parameter(
-    "NatGatewayCidr",
-    Description="Nat Gateway CIDR",
-    Default="0.0.0.0/0",
-    Type="String",
+    return {"LaunchTemplate": cfn_types.LaunchTemplateSpecification(
+        LaunchTemplateId=Ref(launch_template),
+        Version=GetAtt(launch_template, "LatestVersionNumber")
+    )}
+
+def add_cpu_credit_alarm(t, tier, settings, asg, scaling_out):
+    # With standard credits a burstable tier is throttled to its baseline once
+    # the balance is spent, so scale out while credits are still left.
+    if settings.get("credit_specification") != "standard":
+        return
+    minimum = settings.get("min_cpu_credits", 20)
+    t.add_resource(Alarm(
+        tier + "LowCpuCreditBalanceAlarm",
+        AlarmDescription="Alarm if less than %s CPU credits are left" % minimum,
+        Namespace="AWS/EC2",
+        Dimensions=[
+                MetricDimension(
+                    Name="AutoScalingGroupName",
+                    Value=Ref(asg)
+                ),
+            ],
+        MetricName="CPUCreditBalance",
+        Statistic="Average",
+        Period="300",
+        EvaluationPeriods="1",
+        Threshold=str(minimum),
+        ComparisonOperator="LessThanThreshold",
+        AlarmActions=[Ref(scaling_out)]
     ))
 
-igwCidr_param = t.add_parameter(Parameter(
-    "InternetGatewayCidr",
-    Description="Internet Gateway CIDR",
-    Default="0.0.0.0/0",
-    Type="String",
-    ))
+# CloudWatch agent
+
+# Per architecture, amd64 or arm64
+CLOUDWATCH_AGENT_RPM = ("https://s3.amazonaws.com/amazoncloudwatch-agent/"
+                        "amazon_linux/%s/latest/amazon-cloudwatch-agent.rpm")
+CLOUDWATCH_AGENT_CONFIG = ("/opt/aws/amazon-cloudwatch-agent/etc/"
+                           "amazon-cloudwatch-agent.json")
+
+def cloudwatch_agent_config(settings):
+    # Memory, disk and process metrics every `resolution` seconds (below 60
+    # they are stored as high-resolution metrics), aggregated per Auto Scaling
+    # group so alarms can watch the whole tier.
+    resolution = int(settings.get("resolution", 60))
+    if resolution not in (10, 60):
+        raise ValueError("cloudwatch_agent.resolution must be 10 or 60")
+    return {
+        "agent": {
+            "metrics_collection_interval": resolution,
+        },
+        "metrics": {
+            "namespace": settings.get("namespace", "System/Linux"),
+            "append_dimensions": {
+                "AutoScalingGroupName": "${aws:AutoScalingGroupName}",
+                "InstanceId": "${aws:InstanceId}",
+            },
+            "aggregation_dimensions": [["AutoScalingGroupName"]],
+            "metrics_collected": {
+                "mem": {
+                    "measurement": [
+                        {"name": "mem_available", "rename": "MemoryAvailable",
+                         "unit": "Bytes"},
+                        {"name": "mem_used_percent",
+                         "rename": "MemoryUtilization", "unit": "Percent"},
+                    ],
+                },
+                "disk": {
+                    "resources": ["/"],
+                    "measurement": [
+                        {"name": "used_percent", "rename": "DiskSpaceUtilization",
+                         "unit": "Percent"},
+                    ],
+                    "drop_device": True,
+                },
+                "processes": {
+                    "measurement": ["running", "blocked", "total"],
+                },
+            },
+        },
+    }
+
+def cloudwatch_agent_user_data(settings, instance_type):
+    # The agent package has to match the architecture of the instance type
+    architecture = "amd64"
+    if instance_type.split(".")[0] in ARM64_FAMILIES:
+        architecture = "arm64"
+    config = json.dumps(cloudwatch_agent_config(settings), indent=2,
+                        sort_keys=True, separators=(',', ': '))
+    return Base64("\n".join([
+        "#!/bin/bash",
+        "rpm -q amazon-cloudwatch-agent || rpm -Uvh " +
+        CLOUDWATCH_AGENT_RPM % architecture,
+        "cat > %s <<'EOF'" % CLOUDWATCH_AGENT_CONFIG,
+        config,
+        "EOF",
+        "/opt/aws/amazon-cloudwatch-agent/bin/amazon-cloudwatch-agent-ctl "
+        "-a fetch-config -m ec2 -c file:%s -s" % CLOUDWATCH_AGENT_CONFIG,
+        "",
+    ]))
+
+# Template
+
+def build_template(spec, priorities, shards):
+    placeholders = placeholder_values(spec)
+    if placeholders:
+        raise ValueError("spec still has %s placeholders in %s"
+                         % (PLACEHOLDER, ", ".join(placeholders)))
+
+    t = Template()
+
+    t.add_description(spec["project"]["desc"])
+
+    # tag variables
+    resource_tag = spec["project"]["tag"]
+    project_name = spec["project"]["name"]
+    environment_name = spec["project"]["env"]
+    ticket = spec["project"]["ticket"]
+    availability_zone_1 = spec["project"]["az1"]
+    availability_zone_2 = spec["project"]["az2"]
+    vpc_cidr = spec["project"].get("vpc_cidr", "10.0.0.0/16")
+    vpc_cidr_range(vpc_cidr)
+
+    # params
+
+    vpcCidr_param = t.add_parameter(Parameter(
+        "VpcCidr",
+        Description="VPC CIDR",
+        Default=vpc_cidr,
+        Type="String",
+        ))
 
-publicSubnet01Cidr_param = t.add_parameter(Parameter(
-    "PublicSubnet01Cidr",
-    Description="PublicSubnet01 CIDR",
-    Default="10.0.0.0/24",
-    Type="String",
-    ))
+    natGatewayCidr_param = t.add_parameter(Parameter(
+        "NatGatewayCidr",
+        Description="Nat Gateway CIDR",
+        Default="0.0.0.0/0",
+        Type="String",
+        ))
 
-publicSubnet02Cidr_param = t.add_parameter(Parameter(
-    "PublicSubnet02Cidr",
-    Description="PublicSubnet02 CIDR",
-    Default="10.0.1.0/24",
-    Type="String",
-    ))
+    igwCidr_param = t.add_parameter(Parameter(
+        "InternetGatewayCidr",
+        Description="Internet Gateway CIDR",
+        Default="0.0.0.0/0",
+        Type="String",
+        ))
 
-privateWebSubnet01Cidr_param = t.add_parameter(Parameter(
-    "privateWebSubnet01Cidr",
-    Description="PrivateWebSubnet01 CIDR",
-    Default="10.0.2.0/24",
-    Type="String",
-    ))
+    publicSubnet01Cidr_param = t.add_parameter(Parameter(
+        "PublicSubnet01Cidr",
+        Description="PublicSubnet01 CIDR",
+        Default=subnet_cidr(vpc_cidr, 0),
+        Type="String",
+        ))
 
-privateWebSubnet02Cidr_param = t.add_parameter(Parameter(
-    "privateWebSubnet02Cidr",
-    Description="PrivateWebSubnet02 CIDR",
-    Default="10.0.3.0/24",
-    Type="String",
-    ))
+    publicSubnet02Cidr_param = t.add_parameter(Parameter(
+        "PublicSubnet02Cidr",
+        Description="PublicSubnet02 CIDR",
+        Default=subnet_cidr(vpc_cidr, 1),
+        Type="String",
+        ))
 
-privateDbSubnet01Cidr_param = t.add_parameter(Parameter(
-    "privateDbSubnet01Cidr",
-    Description="PrivateDbSubnet01 CIDR",
-    Default="10.0.4.0/24",
-    Type="String",
-    ))
+    privateWebSubnet01Cidr_param = t.add_parameter(Parameter(
+        "privateWebSubnet01Cidr",
+        Description="PrivateWebSubnet01 CIDR",
+        Default=subnet_cidr(vpc_cidr, 2),
+        Type="String",
+        ))
 
-privateDbSubnet02Cidr_param = t.add_parameter(Parameter(
-    "privateDbSubnet02Cidr",
-    Description="PrivateDbSubnet02 CIDR",
-    Default="10.0.5.0/24",
-    Type="String",
-    ))
+    privateWebSubnet02Cidr_param = t.add_parameter(Parameter(
+        "privateWebSubnet02Cidr",
+        Description="PrivateWebSubnet02 CIDR",
+        Default=subnet_cidr(vpc_cidr, 3),
+        Type="String",
+        ))
 
-availabilityZone01_param = t.add_parameter(Parameter(
-    "AvailabilityZone01",
-    Description="VPC AvailabilityZone01",
-    Default=availability_zone_1,
-    Type="String",
-    ))
+    privateDbSubnet01Cidr_param = t.add_parameter(Parameter(
+        "privateDbSubnet01Cidr",
+        Description="PrivateDbSubnet01 CIDR",
+        Default=subnet_cidr(vpc_cidr, 4),
+        Type="String",
+        ))
 
-availabilityZone02_param = t.add_parameter(Parameter(
-    "AvailabilityZone02",
-    Description="VPC AvailabilityZone02",
-    Default=availability_zone_2,
-    Type="String",
-    ))
+    privateDbSubnet02Cidr_param = t.add_parameter(Parameter(
+        "privateDbSubnet02Cidr",
+        Description="PrivateDbSubnet02 CIDR",
+        Default=subnet_cidr(vpc_cidr, 5),
+        Type="String",
+        ))
 
-tomcatPort_param = t.add_parameter(Parameter(
-        "tomcatPort",
+    availabilityZone01_param = t.add_parameter(Parameter(
+        "AvailabilityZone01",
+        Description="VPC AvailabilityZone01",
+        Default=availability_zone_1,
         Type="String",
-        Default="80",
-        Description="TCP/IP port of the web server",
-    ))
+        ))
 
-dbPort_param = t.add_parameter(Parameter(
-        "dbPort",
+    availabilityZone02_param = t.add_parameter(Parameter(
+        "AvailabilityZone02",
+        Description="VPC AvailabilityZone02",
+        Default=availability_zone_2,
         Type="String",
-        Default="3306",
-        Description="TCP/IP port of the web server",
-    ))
-
-# Auto scaling group parameters
-
-# Web Layer
-
-web_asg_capacity = t.add_parameter(Parameter(
-        "webAsgCapacity",
-        Default="2",
-        Type="Number",
-        Description="Desired capcacity of AutoScalingGroup"
-    ))
-web_asg_min_size = t.add_parameter(Parameter(
-        "webAsgMinSize",
-        Default="2",
-        Type="Number",
-        Description="Minimum size of AutoScalingGroup"
-    ))
-web_asg_max_size = t.add_parameter(Parameter(
-        "webAsgMaxSize",
-        Default="5",
-        Type="Number",
-        Description="Maximum size of AutoScalingGroup"
-    ))
-web_asg_cooldown = t.add_parameter(Parameter(
-        "webAsgCooldown",
-        Default="360",
-        Type="Number",
-        Description="Cooldown before starting/stopping another instance"
-    ))
-web_asg_health_grace = t.add_parameter(Parameter(
-        "webAsgHealthGrace",
-        Default="360",
-        Type="Number",
-        Description="Wait before starting/stopping another instance"
-    ))
-
-# API Layer
-api_asg_capacity = t.add_parameter(Parameter(
-        "apiAsgCapacity",
-        Default="2",
-        Type="Number",
-        Description="Desired capcacity of AutoScalingGroup"
-    ))
-api_asg_min_size = t.add_parameter(Parameter(
-        "apiAsgMinSize",
-        Default="2",
-        Type="Number",
-        Description="Minimum size of AutoScalingGroup"
-    ))
-api_asg_max_size = t.add_parameter(Parameter(
-        "apiAsgMaxSize",
-        Default="5",
-        Type="Number",
-        Description="Maximum size of AutoScalingGroup"
-    ))
-api_asg_cooldown = t.add_parameter(Parameter(
-        "apiAsgCooldown",
-        Default="360",
-        Type="Number",
-        Description="Cooldown before starting/stopping another instance"
-    ))
-api_asg_health_grace = t.add_parameter(Parameter(
-        "apiAsgHealthGrace",
-        Default="360",
-        Type="Number",
-        Description="Wait before starting/stopping another instance"
-    ))
-
-# VPC
-VPC = t.add_resource(
-    VPC(
-        "VPC",
-        EnableDnsSupport="true",
-        CidrBlock=Ref(vpcCidr_param),
-        EnableDnsHostnames="true",
-        Tags=Tags(
-            Name=Join("",[resource_tag,"-",environment_name,"-VPC"]),
-            Environment=environment_name,
-            Project=project_name,
-            Ticket=ticket
-        )
-))
-
-# Public Subnets
-publicSubnet01 = t.add_resource(Subnet(
-    "publicSubnet01",
-    VpcId=Ref("VPC"),
-    AvailabilityZone=Ref(availabilityZone01_param),
-    CidrBlock=Ref(publicSubnet01Cidr_param),
-    MapPublicIpOnLaunch=True,
-    Tags=Tags(
-        Name=Join("",[resource_tag,"-PublicSubnet-01"]),
-        Environment=environment_name,
-        Project=project_name,
-        Ticket=ticket
-    )
-))
-
-publicSubnet02 = t.add_resource(Subnet(
-    "publicSubnet02",
-    VpcId=Ref("VPC"),
-    AvailabilityZone=Ref(availabilityZone02_param),
-    CidrBlock=Ref(publicSubnet02Cidr_param),
-    MapPublicIpOnLaunch=True,
-    Tags=Tags(
-        Name=Join("",[resource_tag,"-PublicSubnet-02"]),
-        Environment=environment_name,
-        Project=project_name,
-        Ticket=ticket
-    )
-))
-
-# Private Subnets
-privateWebSubnet01 = t.add_resource(Subnet(
-    "privateWebSubnet01",
-    VpcId=Ref("VPC"),
-    AvailabilityZone=Ref(availabilityZone01_param),
-    CidrBlock=Ref(privateWebSubnet01Cidr_param),
-    Tags=Tags(
-        Name=Join("",[resource_tag,"-PrivateWebSubnet-01"]),
-        Environment=environment_name,
-        Project=project_name,
-        Ticket=ticket
-    )
-))
-
-privateWebSubnet02 = t.add_resource(Subnet(
-    "privateWebSubnet02",
-    VpcId=Ref("VPC"),
-    AvailabilityZone=Ref(availabilityZone02_param),
-    CidrBlock=Ref(privateWebSubnet02Cidr_param),
-    Tags=Tags(
-        Name=Join("",[resource_tag,"-PrivateWebSubnet-02"]),
-        Environment=environment_name,
-        Project=project_name,
-        Ticket=ticket
-    )
-))
-
-privateDbSubnet01 = t.add_resource(Subnet(
-    "privateDbSubnet01",
-    VpcId=Ref("VPC"),
-    AvailabilityZone=Ref(availabilityZone01_param),
-    CidrBlock=Ref(privateDbSubnet01Cidr_param),
-    Tags=Tags(
-        Name=Join("",[resource_tag,"-PrivateDbSubnet-01"]),
-        Environment=environment_name,
-        Project=project_name,
-        Ticket=ticket
-    )
-))
-
-privateDbSubnet02 = t.add_resource(Subnet(
-    "privateDbSubnet02",
-    VpcId=Ref("VPC"),
-    AvailabilityZone=Ref(availabilityZone02_param),
-    CidrBlock=Ref(privateDbSubnet02Cidr_param),
-    Tags=Tags(
-        Name=Join("",[resource_tag,"-PrivateDbSubnet-02"]),
-        Environment=environment_name,
-        Project=project_name,
-        Ticket=ticket
-    )
-))
-
-# Security Groups
-
-# Generating Bastion security group rules
-bas_security_group_rules = []
-for ip in spec["ops_ips"]["ssh"]:
-    rule=[SecurityGroupRule(
-                IpProtocol='tcp',
-                FromPort='22',
-                ToPort='22',
-                CidrIp=ip)]
-    bas_security_group_rules.extend(rule)
-
-for ip in spec["customer_ips"]["ssh"]:
-    rule=[SecurityGroupRule(
-                IpProtocol='tcp',
-                FromPort='22',
-                ToPort='22',
-                CidrIp=ip)]
-    bas_security_group_rules.extend(rule)
-
-
-basSecurityGroup = t.add_resource(
-    SecurityGroup(
-        'basSecurityGroup',
-        GroupDescription='Allow SSH connections from an approved list of IPs',
-        SecurityGroupIngress=bas_security_group_rules,
-        VpcId=Ref(VPC),
+        ))
+
+    tomcatPort_param = t.add_parameter(Parameter(
+            "tomcatPort",
+            Type="String",
+            Default="80",
+            Description="TCP/IP port of the web server",
+        ))
+
+    dbPort_param = t.add_parameter(Parameter(
+            "dbPort",
+            Type="String",
+            Default="3306",
+            Description="TCP/IP port of the web server",
+        ))
+
+    # Auto scaling group parameters
+
+    # Web Layer
+
+    web_asg_capacity = t.add_parameter(Parameter(
+            "webAsgCapacity",
+            Default="2",
+            Type="Number",
+            Description="Desired capcacity of AutoScalingGroup"
+        ))
+    web_asg_min_size = t.add_parameter(Parameter(
+            "webAsgMinSize",
+            Default="2",
+            Type="Number",
+            Description="Minimum size of AutoScalingGroup"
+        ))
+    web_asg_max_size = t.add_parameter(Parameter(
+            "webAsgMaxSize",
+            Default="5",
+            Type="Number",
+            Description="Maximum size of AutoScalingGroup"
+        ))
+    web_asg_cooldown = t.add_parameter(Parameter(
+            "webAsgCooldown",
+            Default="360",
+            Type="Number",
+            Description="Cooldown before starting/stopping another instance"
+        ))
+    web_asg_health_grace = t.add_parameter(Parameter(
+            "webAsgHealthGrace",
+            Default="360",
+            Type="Number",
+            Description="Wait before starting/stopping another instance"
+        ))
+
+    # API Layer
+    api_asg_capacity = t.add_parameter(Parameter(
+            "apiAsgCapacity",
+            Default="2",
+            Type="Number",
+            Description="Desired capcacity of AutoScalingGroup"
+        ))
+    api_asg_min_size = t.add_parameter(Parameter(
+            "apiAsgMinSize",
+            Default="2",
+            Type="Number",
+            Description="Minimum size of AutoScalingGroup"
+        ))
+    api_asg_max_size = t.add_parameter(Parameter(
+            "apiAsgMaxSize",
+            Default="5",
+            Type="Number",
+            Description="Maximum size of AutoScalingGroup"
+        ))
+    api_asg_cooldown = t.add_parameter(Parameter(
+            "apiAsgCooldown",
+            Default="360",
+            Type="Number",
+            Description="Cooldown before starting/stopping another instance"
+        ))
+    api_asg_health_grace = t.add_parameter(Parameter(
+            "apiAsgHealthGrace",
+            Default="360",
+            Type="Number",
+            Description="Wait before starting/stopping another instance"
+        ))
+
+    # VPC
+    vpc = t.add_resource(
+        VPC(
+            "VPC",
+            EnableDnsSupport="true",
+            CidrBlock=Ref(vpcCidr_param),
+            EnableDnsHostnames="true",
+            Tags=Tags(
+                Name=Join("",[resource_tag,"-",environment_name,"-VPC"]),
+                Environment=environment_name,
+                Project=project_name,
+                Ticket=ticket
+            )
+    ))
+
+    # VPC flow logs, delivered to S3 as Parquet in Hive-style hourly partitions
+    flow_logs = spec.get("flow_logs")
+    if flow_logs:
+        log_destination = flow_logs["bucket_arn"]
+        if flow_logs.get("prefix"):
+            log_destination += "/" + flow_logs["prefix"].strip("/") + "/"
+        max_aggregation_interval = int(
+            flow_logs.get("max_aggregation_interval", 600))
+        if max_aggregation_interval not in (60, 600):
+            raise ValueError("flow_logs.max_aggregation_interval must be 60 "
+                             "or 600")
+        flow_log_options = {}
+        if flow_logs.get("log_format"):
+            flow_log_options["LogFormat"] = flow_logs["log_format"]
+        t.add_resource(cfn_types.FlowLog(
+            "vpcFlowLog",
+            ResourceId=Ref(vpc),
+            ResourceType="VPC",
+            TrafficType=flow_logs.get("traffic_type", "ALL"),
+            LogDestinationType="s3",
+            LogDestination=log_destination,
+            DestinationOptions=cfn_types.DestinationOptions(
+                FileFormat="parquet",
+                HiveCompatiblePartitions=True,
+                PerHourPartition=True
+            ),
+            MaxAggregationInterval=max_aggregation_interval,
+            Tags=Tags(
+                Name=Join("",[resource_tag,"-",environment_name,"-FlowLog"]),
+                Environment=environment_name,
+                Project=project_name,
+                Ticket=ticket
+            ),
+            **flow_log_options
+        ))
+
+    # Public Subnets
+    publicSubnet01 = t.add_resource(Subnet(
+        "publicSubnet01",
+        VpcId=Ref("VPC"),
+        AvailabilityZone=Ref(availabilityZone01_param),
+        CidrBlock=Ref(publicSubnet01Cidr_param),
+        MapPublicIpOnLaunch=True,
         Tags=Tags(
-            Name=Join("",[resource_tag,"-basSecurityGroup"]),
+            Name=Join("",[resource_tag,"-PublicSubnet-01"]),
             Environment=environment_name,
             Project=project_name,
             Ticket=ticket
         )
     ))
 
-# Generating Load Balancer security group rules
-alb_security_group_ingress_rules = []
-
-albSecurityGroup = t.add_resource(
-    SecurityGroup(
-        'albSecurityGroup',
-        GroupDescription='Allow all necessary ports from the internet',
-        SecurityGroupIngress=[
-            SecurityGroupRule(
-                IpProtocol='tcp',
-                FromPort='443',
-                ToPort='443',
-                CidrIp='0.0.0.0/0'),
-            SecurityGroupRule(
-                IpProtocol='tcp',
-                FromPort='80',
-                ToPort='80',
-                CidrIp='0.0.0.0/0')
-        ],
-        VpcId=Ref(VPC),
+    publicSubnet02 = t.add_resource(Subnet(
+        "publicSubnet02",
+        VpcId=Ref("VPC"),
+        AvailabilityZone=Ref(availabilityZone02_param),
+        CidrBlock=Ref(publicSubnet02Cidr_param),
+        MapPublicIpOnLaunch=True,
         Tags=Tags(
-            Name=Join("",[resource_tag,"-albSecurityGroup"]),
+            Name=Join("",[resource_tag,"-PublicSubnet-02"]),
             Environment=environment_name,
             Project=project_name,
             Ticket=ticket
         )
     ))
 
-
-feSecurityGroup = t.add_resource(
-    SecurityGroup(
-        'feSecurityGroup',
-        GroupDescription='Allow connections from Bastion and LB',
-        SecurityGroupIngress=[
-            SecurityGroupRule(
-                IpProtocol='tcp',
-                FromPort='22',
-                ToPort='22',
-                SourceSecurityGroupId=Ref(basSecurityGroup)),
-            SecurityGroupRule(
-                IpProtocol='tcp',
-                FromPort=Ref(tomcatPort_param),
-                ToPort=Ref(tomcatPort_param),
-                SourceSecurityGroupId=Ref(albSecurityGroup))
-        ],
-        VpcId=Ref(VPC),
+    # Private Subnets
+    privateWebSubnet01 = t.add_resource(Subnet(
+        "privateWebSubnet01",
+        VpcId=Ref("VPC"),
+        AvailabilityZone=Ref(availabilityZone01_param),
+        CidrBlock=Ref(privateWebSubnet01Cidr_param),
         Tags=Tags(
-            Name=Join("",[resource_tag,"-feSecurityGroup"]),
+            Name=Join("",[resource_tag,"-PrivateWebSubnet-01"]),
             Environment=environment_name,
             Project=project_name,
             Ticket=ticket
         )
     ))
 
-rdsSecurityGroup = t.add_resource(
-    SecurityGroup(
-        'rdsSecurityGroup',
-        GroupDescription='RDS security group',
-        SecurityGroupIngress=[
-            SecurityGroupRule(
-                IpProtocol='tcp',
-                FromPort=Ref(dbPort_param),
-                ToPort=Ref(dbPort_param),
-                SourceSecurityGroupId=Ref(basSecurityGroup)),
-            SecurityGroupRule(
-                IpProtocol='tcp',
-                FromPort=Ref(dbPort_param),
-                ToPort=Ref(dbPort_param),
-                SourceSecurityGroupId=Ref(feSecurityGroup))
-        ],
-        VpcId=Ref(VPC),
+    privateWebSubnet02 = t.add_resource(Subnet(
+        "privateWebSubnet02",
+        VpcId=Ref("VPC"),
+        AvailabilityZone=Ref(availabilityZone02_param),
+        CidrBlock=Ref(privateWebSubnet02Cidr_param),
         Tags=Tags(
-            Name=Join("",[resource_tag,"-rdsSecurityGroup"]),
+            Name=Join("",[resource_tag,"-PrivateWebSubnet-02"]),
             Environment=environment_name,
             Project=project_name,
             Ticket=ticket
         )
-
     ))
 
-# Internet Gateway
-internetGateway = t.add_resource(
-    InternetGateway(
-        "InternetGateway",
-        Tags=Tags(
-            Name=Join("",[resource_tag,"-IGW"]),
-            Environment=environment_name,
-            Project=project_name,
-            Ticket=ticket
-    )
-))
-
-igwVpcAttachment = t.add_resource(
-    VPCGatewayAttachment(
-        'AttachInternetGatewayToVPC',
-        VpcId=Ref(VPC),
-        InternetGatewayId=Ref(internetGateway)
-))
-
-# Public Subnet Route Table
-publicRouteTable = t.add_resource(
-    RouteTable(
-        "publicRouteTable",
+    privateDbSubnet01 = t.add_resource(Subnet(
+        "privateDbSubnet01",
         VpcId=Ref("VPC"),
+        AvailabilityZone=Ref(availabilityZone01_param),
+        CidrBlock=Ref(privateDbSubnet01Cidr_param),
         Tags=Tags(
-            Name=Join("",[resource_tag,"-PublicRouteTable"]),
+            Name=Join("",[resource_tag,"-PrivateDbSubnet-01"]),
             Environment=environment_name,
             Project=project_name,
             Ticket=ticket
         )
-))
-
-publicSubnet01Association = t.add_resource(SubnetRouteTableAssociation(
-    "publicSubnet01Association",
-    SubnetId=Ref("publicSubnet01"),
-    RouteTableId=Ref(publicRouteTable),
-))
-
-publicSubnet02Association = t.add_resource(SubnetRouteTableAssociation(
-    "publicSubnet02Association",
-    SubnetId=Ref("publicSubnet02"),
-    RouteTableId=Ref(publicRouteTable),
-))
-
-igwRouteAttachment = t.add_resource(
-    Route(
-        'AttachInternetGatewayToPublicRouteTable',
-        DestinationCidrBlock=Ref(igwCidr_param),
-        GatewayId=Ref(internetGateway),
-        RouteTableId=Ref(publicRouteTable)
-))
-
-# Private Subnet Route Table
-natRouteTable = t.add_resource(
-    RouteTable(
-        "natRouteTable",
+    ))
+
+    privateDbSubnet02 = t.add_resource(Subnet(
+        "privateDbSubnet02",
         VpcId=Ref("VPC"),
+        AvailabilityZone=Ref(availabilityZone02_param),
+        CidrBlock=Ref(privateDbSubnet02Cidr_param),
         Tags=Tags(
-            Name=Join("",[resource_tag,"-NatRouteTable"]),
+            Name=Join("",[resource_tag,"-PrivateDbSubnet-02"]),
             Environment=environment_name,
             Project=project_name,
             Ticket=ticket
         )
-))
-
-natRouteWeb01Association = t.add_resource(
-    SubnetRouteTableAssociation(
-        "natRouteWeb01Association",
-        SubnetId=Ref("privateWebSubnet01"),
-        RouteTableId=Ref(natRouteTable),
-))
-
-natRouteWeb02Association = t.add_resource(
-    SubnetRouteTableAssociation(
-        "natRouteWeb02Association",
-        SubnetId=Ref("privateWebSubnet02"),
-        RouteTableId=Ref(natRouteTable),
-))
-
-natRouteDb01Association = t.add_resource(
-    SubnetRouteTableAssociation(
-        "natRouteDb01Association",
-        SubnetId=Ref("privateDbSubnet01"),
-        RouteTableId=Ref(natRouteTable),
-))
-
-natRouteDb02Association = t.add_resource(
-    SubnetRouteTableAssociation(
-        "natRouteDb02Association",
-        SubnetId=Ref("privateDbSubnet02"),
-        RouteTableId=Ref(natRouteTable),
-))
-
-natElasticIp = t.add_resource(
-    EIP(
-        "natElasticIp",
-        Domain="vpc",
-))
-
-natGateway = t.add_resource(
-    NatGateway(
-        "natGateway",
-        AllocationId=GetAtt(natElasticIp, 'AllocationId'),
-        SubnetId=Ref("publicSubnet01")
-    )
-)
-
-natRouteAttachment = t.add_resource(
-    Route(
-        'AttachNatGatewayToPrivateRouteTable',
-        DestinationCidrBlock=Ref(natGatewayCidr_param),
-        NatGatewayId=Ref(natGateway),
-        RouteTableId=Ref(natRouteTable)
-))
+    ))
 
-# Public Subnet Instances
+    # Security Groups
+
+    # Generating Bastion security group rules
+    bas_security_group_rules = []
+    for ip in spec["ops_ips"]["ssh"]:
+        rule=[SecurityGroupRule(
+                    IpProtocol='tcp',
+                    FromPort='22',
+                    ToPort='22',
+                    CidrIp=ip)]
+        bas_security_group_rules.extend(rule)
+
+    for ip in spec["customer_ips"]["ssh"]:
+        rule=[SecurityGroupRule(
+                    IpProtocol='tcp',
+                    FromPort='22',
+                    ToPort='22',
+                    CidrIp=ip)]
+        bas_security_group_rules.extend(rule)
+
+
+    basSecurityGroup = t.add_resource(
+        SecurityGroup(
+            'basSecurityGroup',
+            GroupDescription='Allow SSH connections from an approved list of IPs',
+            SecurityGroupIngress=bas_security_group_rules,
+            VpcId=Ref(vpc),
+            Tags=Tags(
+                Name=Join("",[resource_tag,"-basSecurityGroup"]),
+                Environment=environment_name,
+                Project=project_name,
+                Ticket=ticket
+            )
+        ))
 
-# Bastion
+    # Generating Load Balancer security group rules
+    alb_security_group_ingress_rules = []
+
+    albSecurityGroup = t.add_resource(
+        SecurityGroup(
+            'albSecurityGroup',
+            GroupDescription='Allow all necessary ports from the internet',
+            SecurityGroupIngress=[
+                SecurityGroupRule(
+                    IpProtocol='tcp',
+                    FromPort='443',
+                    ToPort='443',
+                    CidrIp='0.0.0.0/0'),
+                SecurityGroupRule(
+                    IpProtocol='tcp',
+                    FromPort='80',
+                    ToPort='80',
+                    CidrIp='0.0.0.0/0')
+            ],
+            VpcId=Ref(vpc),
+            Tags=Tags(
+                Name=Join("",[resource_tag,"-albSecurityGroup"]),
+                Environment=environment_name,
+                Project=project_name,
+                Ticket=ticket
+            )
+        ))
 
-if spec["bastion"]:
 
-    bas_num_nodes = spec["bastion"]["num_nodes"]
-    bas_name = spec["bastion"]["canonical_name"]
-    bas_instance_type = spec["bastion"]["ec2_instance_type"]
-    bas_ami_id = spec["bastion"]["ami_id"]
+    feSecurityGroup = t.add_resource(
+        SecurityGroup(
+            'feSecurityGroup',
+            GroupDescription='Allow connections from Bastion and LB',
+            SecurityGroupIngress=[
+                SecurityGroupRule(
+                    IpProtocol='tcp',
+                    FromPort='22',
+                    ToPort='22',
+                    SourceSecurityGroupId=Ref(basSecurityGroup)),
+                SecurityGroupRule(
+                    IpProtocol='tcp',
+                    FromPort=Ref(tomcatPort_param),
+                    ToPort=Ref(tomcatPort_param),
+                    SourceSecurityGroupId=Ref(albSecurityGroup))
+            ],
+            VpcId=Ref(vpc),
+            Tags=Tags(
+                Name=Join("",[resource_tag,"-feSecurityGroup"]),
+                Environment=environment_name,
+                Project=project_name,
+                Ticket=ticket
+            )
+        ))
 
-    for bas_node in xrange(1, int(bas_num_nodes)+1):
-        t.add_resource(Instance(
-            "bas"+str(bas_node).zfill(2) ,
-            SourceDestCheck="false",
-            ImageId=bas_ami_id,
-            InstanceType=bas_instance_type,
-            KeyName=spec["key_name"],
+    rdsSecurityGroup = t.add_resource(
+        SecurityGroup(
+            'rdsSecurityGroup',
+            GroupDescription='RDS security group',
+            SecurityGroupIngress=[
+                SecurityGroupRule(
+                    IpProtocol='tcp',
+                    FromPort=Ref(dbPort_param),
+                    ToPort=Ref(dbPort_param),
+                    SourceSecurityGroupId=Ref(basSecurityGroup)),
+                SecurityGroupRule(
+                    IpProtocol='tcp',
+                    FromPort=Ref(dbPort_param),
+                    ToPort=Ref(dbPort_param),
+                    SourceSecurityGroupId=Ref(feSecurityGroup))
+            ],
+            VpcId=Ref(vpc),
             Tags=Tags(
-                Name=Join("",[resource_tag,"-",bas_name,"-",str(bas_node).zfill(2)]),
+                Name=Join("",[resource_tag,"-rdsSecurityGroup"]),
                 Environment=environment_name,
                 Project=project_name,
                 Ticket=ticket
-            )   
+            )
+
         ))
 
+    # Internet Gateway
+    internetGateway = t.add_resource(
+        InternetGateway(
+            "InternetGateway",
+            Tags=Tags(
+                Name=Join("",[resource_tag,"-IGW"]),
+                Environment=environment_name,
+                Project=project_name,
+                Ticket=ticket
+        )
+    ))
 
-# Application ELB
+    igwVpcAttachment = t.add_resource(
+        VPCGatewayAttachment(
+            'AttachInternetGatewayToVPC',
+            VpcId=Ref(vpc),
+            InternetGatewayId=Ref(internetGateway)
+    ))
 
-application_load_balancer = t.add_resource(elb.LoadBalancer(
-    "applicationLoadBalancer",
-    Name=Join("",[resource_tag,"-ALB"]),
-    Scheme="internet-facing",
-    Subnets=[Ref(publicSubnet01),Ref(publicSubnet02)],
-    SecurityGroups=[Ref(albSecurityGroup)],
-    Tags=Tags(
-        Name=Join("",[resource_tag,"-ALB"]),
-        Environment=environment_name,
-        Project=project_name,
-        Ticket=ticket
-    )  
-))
-
-default_target_group = t.add_resource(elb.TargetGroup(
-    "defaultTargetGroup",
-    Name=resource_tag + "-default",
-    HealthCheckPath="/",
-    HealthCheckIntervalSeconds="20",
-    HealthCheckProtocol="HTTP",
-    HealthCheckTimeoutSeconds="10",
-    HealthyThresholdCount="4",
-    Matcher=elb.Matcher(
-        HttpCode="301"),
-    Port=80,
-    Protocol="HTTP",
-    UnhealthyThresholdCount="3",
-    VpcId=Ref(VPC),
-    Tags=Tags(
-        Name=resource_tag + "default",
-        Environment=environment_name,
-        Project=project_name,
-        Ticket=ticket
-    )   
-))
-
-http_listener = t.add_resource(elb.Listener(
-    "albHttpListener",
-    Port="80",
-    Protocol="HTTP",
-    LoadBalancerArn=Ref(application_load_balancer),
-    DefaultActions=[elb.Action(
-        Type="forward",
-        TargetGroupArn=Ref(default_target_group)
-    )]
-))
-
-https_listener = t.add_resource(elb.Listener(
-    "albHttpsListener",
-    Port="443",
-    Protocol="HTTPS",
-    Certificates=[elb.Certificate(
-        CertificateArn=spec["ssl_cert"]
-    )],
-    LoadBalancerArn=Ref(application_load_balancer),
-    DefaultActions=[elb.Action(
-        Type="forward",
-        TargetGroupArn=Ref(default_target_group)
-    )]
-))
-
-customers = spec["customers"]
-target_groups = {}
-web_target_groups = []
-web_target_groups.append(Ref("defaultTargetGroup"))
-
-api_target_groups = []
-
-listeners = {}
-priority = 1
-
-for cust in customers:
-
-    port = spec["customers"][cust]["port"]
-    canonical_name = spec["customers"][cust]["canonical_name"]
-    
-    target_groups[cust]={}
+    # Public Subnet Route Table
+    publicRouteTable = t.add_resource(
+        RouteTable(
+            "publicRouteTable",
+            VpcId=Ref("VPC"),
+            Tags=Tags(
+                Name=Join("",[resource_tag,"-PublicRouteTable"]),
+                Environment=environment_name,
+                Project=project_name,
+                Ticket=ticket
+            )
+    ))
 
-    target_groups[cust]["web"] = t.add_resource(elb.TargetGroup(
-        canonical_name + "WebTargetGroup",
-        HealthCheckPath="/",
-        HealthCheckIntervalSeconds="20",
-        HealthCheckProtocol="HTTP",
-        HealthCheckTimeoutSeconds="10",
-        HealthyThresholdCount="4",
-        Matcher=elb.Matcher(
-            HttpCode="200"),
-        Name=Join("",[resource_tag,"-",str(cust),"-webLayer"]),
-        Port=port,
-        Protocol="HTTP",
-        UnhealthyThresholdCount="3",
-        VpcId=Ref(VPC),
+    publicSubnet01Association = t.add_resource(SubnetRouteTableAssociation(
+        "publicSubnet01Association",
+        SubnetId=Ref("publicSubnet01"),
+        RouteTableId=Ref(publicRouteTable),
+    ))
+
+    publicSubnet02Association = t.add_resource(SubnetRouteTableAssociation(
+        "publicSubnet02Association",
+        SubnetId=Ref("publicSubnet02"),
+        RouteTableId=Ref(publicRouteTable),
+    ))
+
+    igwRouteAttachment = t.add_resource(
+        Route(
+            'AttachInternetGatewayToPublicRouteTable',
+            # The route can't be created until the gateway is attached
+            DependsOn=igwVpcAttachment.title,
+            DestinationCidrBlock=Ref(igwCidr_param),
+            GatewayId=Ref(internetGateway),
+            RouteTableId=Ref(publicRouteTable)
+    ))
+
+    # Private Subnet Route Table
+    natRouteTable = t.add_resource(
+        RouteTable(
+            "natRouteTable",
+            VpcId=Ref("VPC"),
+            Tags=Tags(
+                Name=Join("",[resource_tag,"-NatRouteTable"]),
+                Environment=environment_name,
+                Project=project_name,
+                Ticket=ticket
+            )
+    ))
+
+    natRouteWeb01Association = t.add_resource(
+        SubnetRouteTableAssociation(
+            "natRouteWeb01Association",
+            SubnetId=Ref("privateWebSubnet01"),
+            RouteTableId=Ref(natRouteTable),
+    ))
+
+    natRouteWeb02Association = t.add_resource(
+        SubnetRouteTableAssociation(
+            "natRouteWeb02Association",
+            SubnetId=Ref("privateWebSubnet02"),
+            RouteTableId=Ref(natRouteTable),
+    ))
+
+    natRouteDb01Association = t.add_resource(
+        SubnetRouteTableAssociation(
+            "natRouteDb01Association",
+            SubnetId=Ref("privateDbSubnet01"),
+            RouteTableId=Ref(natRouteTable),
+    ))
+
+    natRouteDb02Association = t.add_resource(
+        SubnetRouteTableAssociation(
+            "natRouteDb02Association",
+            SubnetId=Ref("privateDbSubnet02"),
+            RouteTableId=Ref(natRouteTable),
+    ))
+
+    natElasticIp = t.add_resource(
+        EIP(
+            "natElasticIp",
+            DependsOn=igwVpcAttachment.title,
+            Domain="vpc",
+    ))
+
+    natGateway = t.add_resource(
+        NatGateway(
+            "natGateway",
+            AllocationId=GetAtt(natElasticIp, 'AllocationId'),
+            SubnetId=Ref("publicSubnet01")
+        )
+    )
+
+    natRouteAttachment = t.add_resource(
+        Route(
+            'AttachNatGatewayToPrivateRouteTable',
+            DestinationCidrBlock=Ref(natGatewayCidr_param),
+            NatGatewayId=Ref(natGateway),
+            RouteTableId=Ref(natRouteTable)
+    ))
+
+    # Public Subnet Instances
+
+    # Bastion
+
+    if spec["bastion"]:
+
+        bas_num_nodes = spec["bastion"]["num_nodes"]
+        bas_name = spec["bastion"]["canonical_name"]
+        bas_instance_type = spec["bastion"]["ec2_instance_type"]
+        bas_ami_id = spec["bastion"]["ami_id"]
+
+        for bas_node in xrange(1, int(bas_num_nodes)+1):
+            t.add_resource(Instance(
+                "bas"+str(bas_node).zfill(2) ,
+                SourceDestCheck="false",
+                ImageId=bas_ami_id,
+                InstanceType=bas_instance_type,
+                KeyName=spec["key_name"],
+                Tags=Tags(
+                    Name=Join("",[resource_tag,"-",bas_name,"-",str(bas_node).zfill(2)]),
+                    Environment=environment_name,
+                    Project=project_name,
+                    Ticket=ticket
+                )   
+            ))
+
+
+    # Application ELB
+
+    alb_options = {}
+    alb_access_logs = spec.get("alb_access_logs")
+    if alb_access_logs:
+        # The bucket has to be in the load balancer's region, and every stack
+        # logs under its own prefix, so both may name {region}, {tag} and
+        # {env} for a base spec shared by several regions and environments
+        log_fields = dict(
+            region=spec_region(spec),
+            tag=resource_tag,
+            env=environment_name
+        )
+        alb_options["LoadBalancerAttributes"] = [
+            elb.LoadBalancerAttributes(
+                Key="access_logs.s3.enabled",
+                Value="true"
+            ),
+            elb.LoadBalancerAttributes(
+                Key="access_logs.s3.bucket",
+                Value=alb_access_logs["bucket"].format(**log_fields)
+            ),
+            elb.LoadBalancerAttributes(
+                Key="access_logs.s3.prefix",
+                Value=alb_access_logs.get("prefix", "").format(**log_fields)
+            ),
+        ]
+
+    application_load_balancer = t.add_resource(elb.LoadBalancer(
+        "applicationLoadBalancer",
+        Name=Join("",[resource_tag,"-ALB"]),
+        Scheme="internet-facing",
+        Subnets=[Ref(publicSubnet01),Ref(publicSubnet02)],
+        SecurityGroups=[Ref(albSecurityGroup)],
         Tags=Tags(
-            Name=Join("",[resource_tag,"-",str(cust),"-webLayer"]),
+            Name=Join("",[resource_tag,"-ALB"]),
             Environment=environment_name,
             Project=project_name,
             Ticket=ticket
-        )   
+        ),
+        **alb_options
     ))
 
-    web_target_groups.append(Ref(target_groups[cust]["web"]))
-
-    target_groups[cust]["api"] = t.add_resource(elb.TargetGroup(
-        canonical_name + "ApiTargetGroup",
-        HealthCheckPath="/api/1.0/robo/version",
+    default_target_group = t.add_resource(elb.TargetGroup(
+        "defaultTargetGroup",
+        Name=resource_tag + "-default",
+        HealthCheckPath="/",
         HealthCheckIntervalSeconds="20",
         HealthCheckProtocol="HTTP",
         HealthCheckTimeoutSeconds="10",
         HealthyThresholdCount="4",
         Matcher=elb.Matcher(
-            HttpCode="200"),
-        Name=Join("",[resource_tag,"-",str(cust),"-apiLayer"]),
-        Port=port,
+            HttpCode="301"),
+        Port=80,
         Protocol="HTTP",
         UnhealthyThresholdCount="3",
-        VpcId=Ref(VPC),
+        VpcId=Ref(vpc),
         Tags=Tags(
-            Name=Join("",[resource_tag,"-",str(cust),"-apiLayer"]),
+            Name=resource_tag + "default",
             Environment=environment_name,
             Project=project_name,
             Ticket=ticket
         )   
     ))
 
-    api_target_groups.append(Ref(target_groups[cust]["api"]))
-
-    t.add_resource(elb.ListenerRule(
-        canonical_name + "apiListenerRule",
-        ListenerArn=Ref(https_listener),
-        Conditions=[elb.Condition(
-            Field="host-header",
-            Values=[Join("", [str(cust),".",spec["domain"]])]
-            ),
-            elb.Condition(
-                Field="path-pattern",
-                Values=["/api/*"]
-            )
-        ],
-        Actions=[elb.Action(
+    http_listener = t.add_resource(elb.Listener(
+        "albHttpListener",
+        Port="80",
+        Protocol="HTTP",
+        LoadBalancerArn=Ref(application_load_balancer),
+        DefaultActions=[elb.Action(
             Type="forward",
-            TargetGroupArn=Ref(target_groups[cust]["api"])
+            TargetGroupArn=Ref(default_target_group)
+        )]
+    ))
+
+    https_listener = t.add_resource(elb.Listener(
+        "albHttpsListener",
+        Port="443",
+        Protocol="HTTPS",
+        Certificates=[elb.Certificate(
+            CertificateArn=spec["ssl_cert"]
         )],
-        Priority=priority
+        LoadBalancerArn=Ref(application_load_balancer),
+        DefaultActions=[elb.Action(
+            Type="forward",
+            TargetGroupArn=Ref(default_target_group)
+        )]
     ))
 
-    priority += 1
+    customers = spec["customers"]
+    target_groups = {}
+    web_target_groups = []
+    web_target_groups.append(Ref("defaultTargetGroup"))
 
-    t.add_resource(elb.ListenerRule(
-        canonical_name + "webListenerRule",
-        ListenerArn=Ref(https_listener),
-        Conditions=[elb.Condition(
-            Field="host-header",
-            Values=[Join("", [str(cust),".",spec["domain"]])]
-            )
-        ],
-        Actions=[elb.Action(
-            Type="forward",
-            TargetGroupArn=Ref(target_groups[cust]["web"])
-        )],
-        Priority=priority
-    ))
-
-    priority += 1
-
-# Auto Scaling Groups
-
-# Web Layer
-# Launchconfiguration
-web_name = spec["web"]["canonical_name"]
-web_instance_type = spec["web"]["ec2_instance_type"]
-web_ami_id = spec["web"]["ami_id"]
-
-webEC2LaunchConfiguration = t.add_resource(autoscaling.LaunchConfiguration(
-    "webEC2LaunchConfiguration",
-    ImageId=web_ami_id,
-    InstanceType=web_instance_type,
-    KeyName=spec["key_name"],
-    AssociatePublicIpAddress=False,
-    SecurityGroups=[Ref(feSecurityGroup)],
-))
-
-
-webASG = t.add_resource(autoscaling.AutoScalingGroup(
-    "webAutoScalingGroup",
-    DesiredCapacity=Ref(web_asg_capacity),
-    TargetGroupARNs=web_target_groups,
-    Tags=autoscaling.Tags(
-        Name=Join("",[resource_tag,"-",web_name]),
-        Environment=environment_name,
-        Project=project_name,
-        Ticket=ticket
-    ),
-    MetricsCollection=[
-        autoscaling.MetricsCollection(
-            Granularity="1Minute"
-        )
-    ],
-    VPCZoneIdentifier=[Ref(privateWebSubnet01),Ref(privateWebSubnet02)],
-    MinSize=Ref(web_asg_min_size),
-    MaxSize=Ref(web_asg_max_size),
-    Cooldown=Ref(web_asg_cooldown),
-    LaunchConfigurationName=Ref(webEC2LaunchConfiguration),
-    HealthCheckGracePeriod=Ref(web_asg_health_grace),
-    HealthCheckType="EC2",
-))
-
-webAsgScalingOut = t.add_resource(autoscaling.ScalingPolicy(
-    "webAsgScalingOut",
-    AdjustmentType="ChangeInCapacity",
-    AutoScalingGroupName=Ref(webASG),
-    Cooldown="360",
-    ScalingAdjustment="1",
-))
-
-webAsgScalingIn = t.add_resource(autoscaling.ScalingPolicy(
-    "webAsgScalingIn",
-    AdjustmentType="ChangeInCapacity",
-    AutoScalingGroupName=Ref(webASG),
-    Cooldown="360",
-    ScalingAdjustment="-1",
-))
-
-webHighHttpRequestsAlarm = t.add_resource(Alarm(
-    "webHighHttpRequestsAlarm",
-    AlarmDescription="Alarm if more than 1000 http requests",
-    Namespace="AWS/SQS",
-    Dimensions=[
-            MetricDimension(
-                Name="AutoScalingGroupName",
-                Value=Ref(webASG)
-            ),
-        ],
-    MetricName="RequestCount",
-    Statistic="Average",
-    Period="1800",
-    EvaluationPeriods="1",
-    Threshold="1000",
-    ComparisonOperator="GreaterThanThreshold",
-    AlarmActions=[Ref(webAsgScalingOut)]
-))
-
-webLowHttpRequestsAlarm = t.add_resource(Alarm(
-    "webLowHttpRequestsAlarm",
-    AlarmDescription="Alarm if less than 1000 http requests",
-    Namespace="AWS/SQS",
-    Dimensions=[
-            MetricDimension(
-                Name="AutoScalingGroupName",
-                Value=Ref(webASG)
-            ),
-        ],
-    MetricName="RequestCount",
-    Statistic="Average",
-    Period="1800",
-    EvaluationPeriods="1",
-    Threshold="1000",
-    ComparisonOperator="LessThanThreshold",
-    AlarmActions=[Ref(webAsgScalingIn)]
-))
-
-# API Layer
-# Launchconfiguration
-
-api_name = spec["api"]["canonical_name"]
-api_instance_type = spec["api"]["ec2_instance_type"]
-api_ami_id = spec["api"]["ami_id"]
-
-apiEC2LaunchConfiguration = t.add_resource(autoscaling.LaunchConfiguration(
-    "apiEC2LaunchConfiguration",
-    ImageId=api_ami_id,
-    #InstanceId=Ref(web01),
-    InstanceType=api_instance_type,
-    KeyName=spec["key_name"],
-    AssociatePublicIpAddress=False,
-    SecurityGroups=[Ref(feSecurityGroup)],
-))
-
-apiASG = t.add_resource(autoscaling.AutoScalingGroup(
-    "apiAutoScalingGroup",
-    DesiredCapacity=Ref(api_asg_capacity),
-    TargetGroupARNs=api_target_groups,
-    Tags=autoscaling.Tags(
-        Name=Join("",[resource_tag,"-",api_name]),
-        Environment=environment_name,
-        Project=project_name,
-        Ticket=ticket
-    ),
-    MetricsCollection=[
-        autoscaling.MetricsCollection(
-            Granularity="1Minute"
-        )
-    ],
-    VPCZoneIdentifier=[Ref(privateWebSubnet01),Ref(privateWebSubnet02)],
-    MinSize=Ref(api_asg_min_size),
-    MaxSize=Ref(api_asg_max_size),
-    Cooldown=Ref(api_asg_cooldown),
-    LaunchConfigurationName=Ref(apiEC2LaunchConfiguration),
-    HealthCheckGracePeriod=Ref(api_asg_health_grace),
-    HealthCheckType="EC2",
-))
-
-apiAsgScalingOut = t.add_resource(autoscaling.ScalingPolicy(
-    "apiAsgScalingOut",
-    AdjustmentType="ChangeInCapacity",
-    AutoScalingGroupName=Ref(apiASG),
-    Cooldown="360",
-    ScalingAdjustment="1",
-))
-
-apiAsgScalingIn = t.add_resource(autoscaling.ScalingPolicy(
-    "apiAsgScalingIn",
-    AdjustmentType="ChangeInCapacity",
-    AutoScalingGroupName=Ref(apiASG),
-    Cooldown="360",
-    ScalingAdjustment="-1",
-))
-
-apiHighMemoryUsageAlarm = t.add_resource(Alarm(
-    "apiHighMemoryUsageAlarm",
-    AlarmDescription="Alarm if less than 512 MB of available memory",
-    Namespace="System/Linux",
-    Dimensions=[
-            MetricDimension(
-                Name="AutoScalingGroupName",
-                Value=Ref(apiASG)
-            ),
-        ],
-    MetricName="MemoryAvailable",
-    Statistic="Average",
-    Period="1800",
-    EvaluationPeriods="1",
-    Threshold="512",
-    ComparisonOperator="LessThanThreshold",
-    AlarmActions=[Ref(apiAsgScalingOut)]
-))
-
-apiLowMemoryUsageAlarm = t.add_resource(Alarm(
-    "apiLowMemoryUsageAlarm",
-    AlarmDescription="Alarm if more than 2048 MB of available memory",
-    Namespace="System/Linux",
-    Dimensions=[
-            MetricDimension(
-                Name="AutoScalingGroupName",
-                Value=Ref(apiASG)
-            ),
-        ],
-    MetricName="MemoryAvailable",
-    Statistic="Average",
-    Period="1800",
-    EvaluationPeriods="1",
-    Threshold="2048",
-    ComparisonOperator="GreaterThanThreshold",
-    AlarmActions=[Ref(apiAsgScalingIn)]
-))
-
-privateDbSubnetGroup = t.add_resource(DBSubnetGroup(
-    "privateDbSubnetGroup",
-    DBSubnetGroupDescription="Subnets available for the RDS DB Instances",
-    SubnetIds=[Ref(privateDbSubnet01), Ref(privateDbSubnet02)]
-))
-
-if spec["rds"]:
-
-    rds_num_nodes = spec["rds"]["num_nodes"]
-    rds_name = spec["rds"]["canonical_name"]
-    rds_master_key = spec["rds"]["master_key"]
-    rds_master_password = spec["rds"]["master_password"]
-    rds_instance_type = spec["rds"]["ec2_instance_type"]
-    rds_allocation_size = spec["rds"]["allocation_size"]
-    rds_parameter_group = spec["rds"]["parameter_group"]
-
-    for rds_node in xrange(1, int(rds_num_nodes)+1):
-        rds_node = t.add_resource(DBInstance(
-            "rds"+str(rds_node).zfill(2),
-            DBName="PlanPlus",
-            DBInstanceIdentifier=Join("",[resource_tag,"-",rds_name,"-",str(rds_node).zfill(2)]),
-            AllocatedStorage=rds_allocation_size[rds_node-1],
-            DBInstanceClass=rds_instance_type,
-            StorageType="gp2",
-            Engine="MySQL",
-            EngineVersion="5.7.19",
-            AutoMinorVersionUpgrade="false",
-            KmsKeyId=rds_master_key,
-            MasterUsername=Join("",["rdsgroup",str(rds_node),"master"]),
-            MasterUserPassword=rds_master_password,
-            StorageEncrypted="true",
-            DBParameterGroupName=rds_parameter_group,
-            DBSubnetGroupName=Ref(privateDbSubnetGroup),
-            VPCSecurityGroups=[Ref(rdsSecurityGroup)],
-            PubliclyAccessible="false",
-            MultiAZ="true",
-            BackupRetentionPeriod="35",
+    api_target_groups = []
+
+    listeners = {}
+
+    for cust in customers:
+
+        port = spec["customers"][cust]["port"]
+        canonical_name = spec["customers"][cust]["canonical_name"]
+        slot = priorities[cust]
+    
+        target_groups[cust]={}
+
+        target_groups[cust]["web"] = t.add_resource(elb.TargetGroup(
+            canonical_name + "WebTargetGroup",
+            HealthCheckPath="/",
+            HealthCheckIntervalSeconds="20",
+            HealthCheckProtocol="HTTP",
+            HealthCheckTimeoutSeconds="10",
+            HealthyThresholdCount="4",
+            Matcher=elb.Matcher(
+                HttpCode="200"),
+            Name=Join("",[resource_tag,"-",str(cust),"-webLayer"]),
+            Port=port,
+            Protocol="HTTP",
+            UnhealthyThresholdCount="3",
+            VpcId=Ref(vpc),
             Tags=Tags(
-                Name=Join("",[resource_tag,"-",rds_name,"-",str(rds_node).zfill(2)]),
+                Name=Join("",[resource_tag,"-",str(cust),"-webLayer"]),
                 Environment=environment_name,
                 Project=project_name,
                 Ticket=ticket
-                )   
+            )   
+        ))
+
+        web_target_groups.append(Ref(target_groups[cust]["web"]))
+
+        target_groups[cust]["api"] = t.add_resource(elb.TargetGroup(
+            canonical_name + "ApiTargetGroup",
+            HealthCheckPath="/api/1.0/robo/version",
+            HealthCheckIntervalSeconds="20",
+            HealthCheckProtocol="HTTP",
+            HealthCheckTimeoutSeconds="10",
+            HealthyThresholdCount="4",
+            Matcher=elb.Matcher(
+                HttpCode="200"),
+            Name=Join("",[resource_tag,"-",str(cust),"-apiLayer"]),
+            Port=port,
+            Protocol="HTTP",
+            UnhealthyThresholdCount="3",
+            VpcId=Ref(vpc),
+            Tags=Tags(
+                Name=Join("",[resource_tag,"-",str(cust),"-apiLayer"]),
+                Environment=environment_name,
+                Project=project_name,
+                Ticket=ticket
+            )   
+        ))
+
+        api_target_groups.append(Ref(target_groups[cust]["api"]))
+
+        t.add_resource(elb.ListenerRule(
+            canonical_name + "apiListenerRule",
+            ListenerArn=Ref(https_listener),
+            Conditions=[elb.Condition(
+                Field="host-header",
+                Values=[Join("", [str(cust),".",spec["domain"]])]
+                ),
+                elb.Condition(
+                    Field="path-pattern",
+                    Values=["/api/*"]
+                )
+            ],
+            Actions=[elb.Action(
+                Type="forward",
+                TargetGroupArn=Ref(target_groups[cust]["api"])
+            )],
+            Priority=2 * slot - 1
+        ))
+
+        t.add_resource(elb.ListenerRule(
+            canonical_name + "webListenerRule",
+            ListenerArn=Ref(https_listener),
+            Conditions=[elb.Condition(
+                Field="host-header",
+                Values=[Join("", [str(cust),".",spec["domain"]])]
+                )
+            ],
+            Actions=[elb.Action(
+                Type="forward",
+                TargetGroupArn=Ref(target_groups[cust]["web"])
+            )],
+            Priority=2 * slot
+        ))
+
+    # Auto Scaling Groups
+
+    # CloudWatch agent on the web and API instances
+    cloudwatch_agent = spec.get("cloudwatch_agent")
+    agent_launch_options = {}
+    if cloudwatch_agent:
+        cloudwatchAgentRole = t.add_resource(iam.Role(
+            "cloudwatchAgentRole",
+            AssumeRolePolicyDocument={
+                "Version": "2012-10-17",
+                "Statement": [{
+                    "Effect": "Allow",
+                    "Principal": {"Service": ["ec2.amazonaws.com"]},
+                    "Action": ["sts:AssumeRole"]
+                }]
+            },
+            ManagedPolicyArns=[
+                "arn:aws:iam::aws:policy/CloudWatchAgentServerPolicy"
+            ]
+        ))
 
+        cloudwatchAgentInstanceProfile = t.add_resource(iam.InstanceProfile(
+            "cloudwatchAgentInstanceProfile",
+            Roles=[Ref(cloudwatchAgentRole)]
         ))
 
-print(t.to_json())
\ No newline at end of file
+        agent_launch_options = dict(
+            IamInstanceProfile=Ref(cloudwatchAgentInstanceProfile)
+        )
+
+    # Web Layer
+    # Launchconfiguration (a launch template with credit_specification)
+    web_name = spec["web"]["canonical_name"]
+    web_instance_type = spec["web"]["ec2_instance_type"]
+    web_ami_id = spec["web"]["ami_id"]
+    web_launch_options, web_group_options = tier_instance_options(
+        t, "web", spec["web"]
+    )
+    web_launch_options.update(agent_launch_options)
+    if cloudwatch_agent:
+        web_launch_options["UserData"] = cloudwatch_agent_user_data(
+            cloudwatch_agent, web_instance_type)
+
+    web_group_options.update(add_launch_resource(
+        t, "web", spec["web"],
+        ImageId=web_ami_id,
+        InstanceType=web_instance_type,
+        KeyName=spec["key_name"],
+        AssociatePublicIpAddress=False,
+        SecurityGroups=[Ref(feSecurityGroup)],
+        **web_launch_options
+    ))
+
+
+    webASG = t.add_resource(cfn_types.AutoScalingGroup(
+        "webAutoScalingGroup",
+        DesiredCapacity=Ref(web_asg_capacity),
+        TargetGroupARNs=web_target_groups,
+        Tags=autoscaling.Tags(
+            Name=Join("",[resource_tag,"-",web_name]),
+            Environment=environment_name,
+            Project=project_name,
+            Ticket=ticket
+        ),
+        MetricsCollection=[
+            autoscaling.MetricsCollection(
+                Granularity="1Minute"
+            )
+        ],
+        VPCZoneIdentifier=[Ref(privateWebSubnet01),Ref(privateWebSubnet02)],
+        MinSize=Ref(web_asg_min_size),
+        MaxSize=Ref(web_asg_max_size),
+        Cooldown=Ref(web_asg_cooldown),
+        HealthCheckGracePeriod=Ref(web_asg_health_grace),
+        HealthCheckType="EC2",
+        **web_group_options
+    ))
+
+    webAsgScalingOut = t.add_resource(autoscaling.ScalingPolicy(
+        "webAsgScalingOut",
+        AdjustmentType="ChangeInCapacity",
+        AutoScalingGroupName=Ref(webASG),
+        Cooldown="360",
+        ScalingAdjustment="1",
+    ))
+
+    webAsgScalingIn = t.add_resource(autoscaling.ScalingPolicy(
+        "webAsgScalingIn",
+        AdjustmentType="ChangeInCapacity",
+        AutoScalingGroupName=Ref(webASG),
+        Cooldown="360",
+        ScalingAdjustment="-1",
+    ))
+
+    traffic_profile = spec.get("traffic_profile")
+    add_cpu_credit_alarm(t, "web", spec["web"], webASG, webAsgScalingOut)
+
+    if traffic_profile and "web" in traffic_profile["tiers"]:
+        add_traffic_scaling(t, traffic_profile, "web", webASG,
+                            int(web_asg_max_size.Default))
+
+    webHighHttpRequestsAlarm = t.add_resource(Alarm(
+        "webHighHttpRequestsAlarm",
+        AlarmDescription="Alarm if more than 1000 http requests",
+        Namespace="AWS/SQS",
+        Dimensions=[
+                MetricDimension(
+                    Name="AutoScalingGroupName",
+                    Value=Ref(webASG)
+                ),
+            ],
+        MetricName="RequestCount",
+        Statistic="Average",
+        Period="1800",
+        EvaluationPeriods="1",
+        Threshold="1000",
+        ComparisonOperator="GreaterThanThreshold",
+        AlarmActions=[Ref(webAsgScalingOut)]
+    ))
+
+    webLowHttpRequestsAlarm = t.add_resource(Alarm(
+        "webLowHttpRequestsAlarm",
+        AlarmDescription="Alarm if less than 1000 http requests",
+        Namespace="AWS/SQS",
+        Dimensions=[
+                MetricDimension(
+                    Name="AutoScalingGroupName",
+                    Value=Ref(webASG)
+                ),
+            ],
+        MetricName="RequestCount",
+        Statistic="Average",
+        Period="1800",
+        EvaluationPeriods="1",
+        Threshold="1000",
+        ComparisonOperator="LessThanThreshold",
+        AlarmActions=[Ref(webAsgScalingIn)]
+    ))
+
+    # API Layer
+    # Launchconfiguration (a launch template with credit_specification)
+
+    api_name = spec["api"]["canonical_name"]
+    api_instance_type = spec["api"]["ec2_instance_type"]
+    api_ami_id = spec["api"]["ami_id"]
+    api_launch_options, api_group_options = tier_instance_options(
+        t, "api", spec["api"]
+    )
+    api_launch_options.update(agent_launch_options)
+    if cloudwatch_agent:
+        api_launch_options["UserData"] = cloudwatch_agent_user_data(
+            cloudwatch_agent, api_instance_type)
+
+    api_group_options.update(add_launch_resource(
+        t, "api", spec["api"],
+        ImageId=api_ami_id,
+        #InstanceId=Ref(web01),
+        InstanceType=api_instance_type,
+        KeyName=spec["key_name"],
+        AssociatePublicIpAddress=False,
+        SecurityGroups=[Ref(feSecurityGroup)],
+        **api_launch_options
+    ))
+
+    apiASG = t.add_resource(cfn_types.AutoScalingGroup(
+        "apiAutoScalingGroup",
+        DesiredCapacity=Ref(api_asg_capacity),
+        TargetGroupARNs=api_target_groups,
+        Tags=autoscaling.Tags(
+            Name=Join("",[resource_tag,"-",api_name]),
+            Environment=environment_name,
+            Project=project_name,
+            Ticket=ticket
+        ),
+        MetricsCollection=[
+            autoscaling.MetricsCollection(
+                Granularity="1Minute"
+            )
+        ],
+        VPCZoneIdentifier=[Ref(privateWebSubnet01),Ref(privateWebSubnet02)],
+        MinSize=Ref(api_asg_min_size),
+        MaxSize=Ref(api_asg_max_size),
+        Cooldown=Ref(api_asg_cooldown),
+        HealthCheckGracePeriod=Ref(api_asg_health_grace),
+        HealthCheckType="EC2",
+        **api_group_options
+    ))
+
+    apiAsgScalingOut = t.add_resource(autoscaling.ScalingPolicy(
+        "apiAsgScalingOut",
+        AdjustmentType="ChangeInCapacity",
+        AutoScalingGroupName=Ref(apiASG),
+        Cooldown="360",
+        ScalingAdjustment="1",
+    ))
+
+    apiAsgScalingIn = t.add_resource(autoscaling.ScalingPolicy(
+        "apiAsgScalingIn",
+        AdjustmentType="ChangeInCapacity",
+        AutoScalingGroupName=Ref(apiASG),
+        Cooldown="360",
+        ScalingAdjustment="-1",
+    ))
+
+    add_cpu_credit_alarm(t, "api", spec["api"], apiASG, apiAsgScalingOut)
+
+    if traffic_profile and "api" in traffic_profile["tiers"]:
+        add_traffic_scaling(t, traffic_profile, "api", apiASG,
+                            int(api_asg_max_size.Default))
+
+    # Memory alarms, on the agent's high-resolution metrics when it is
+    # installed
+    memory_namespace = "System/Linux"
+    memory_period = 1800
+    memory_evaluation_periods = 1
+    memory_unit = 1
+    if cloudwatch_agent:
+        memory_namespace = cloudwatch_agent.get("namespace", "System/Linux")
+        memory_period = int(cloudwatch_agent.get("resolution", 60))
+        memory_evaluation_periods = int(cloudwatch_agent.get(
+            "evaluation_periods", 120 // memory_period))
+        # The agent reports available memory in bytes
+        memory_unit = 1024 * 1024
+
+    apiHighMemoryUsageAlarm = t.add_resource(Alarm(
+        "apiHighMemoryUsageAlarm",
+        AlarmDescription="Alarm if less than 512 MB of available memory",
+        Namespace=memory_namespace,
+        Dimensions=[
+                MetricDimension(
+                    Name="AutoScalingGroupName",
+                    Value=Ref(apiASG)
+                ),
+            ],
+        MetricName="MemoryAvailable",
+        Statistic="Average",
+        Period=str(memory_period),
+        EvaluationPeriods=str(memory_evaluation_periods),
+        Threshold=str(512 * memory_unit),
+        ComparisonOperator="LessThanThreshold",
+        AlarmActions=[Ref(apiAsgScalingOut)]
+    ))
+
+    apiLowMemoryUsageAlarm = t.add_resource(Alarm(
+        "apiLowMemoryUsageAlarm",
+        AlarmDescription="Alarm if more than 2048 MB of available memory",
+        Namespace=memory_namespace,
+        Dimensions=[
+                MetricDimension(
+                    Name="AutoScalingGroupName",
+                    Value=Ref(apiASG)
+                ),
+            ],
+        MetricName="MemoryAvailable",
+        Statistic="Average",
+        Period=str(memory_period),
+        EvaluationPeriods=str(memory_evaluation_periods),
+        Threshold=str(2048 * memory_unit),
+        ComparisonOperator="GreaterThanThreshold",
+        AlarmActions=[Ref(apiAsgScalingIn)]
+    ))
+
+    privateDbSubnetGroup = t.add_resource(DBSubnetGroup(
+        "privateDbSubnetGroup",
+        DBSubnetGroupDescription="Subnets available for the RDS DB Instances",
+        SubnetIds=[Ref(privateDbSubnet01), Ref(privateDbSubnet02)]
+    ))
+
+    if spec["rds"]:
+
+        rds_num_nodes = spec["rds"]["num_nodes"]
+        rds_name = spec["rds"]["canonical_name"]
+        rds_master_key = spec["rds"]["master_key"]
+        rds_master_password = spec["rds"]["master_password"]
+        rds_instance_type = spec["rds"]["ec2_instance_type"]
+        rds_allocation_size = spec["rds"]["allocation_size"]
+        rds_parameter_group = spec["rds"]["parameter_group"]
+
+        rds_instances = {}
+        for rds_node in xrange(1, int(rds_num_nodes)+1):
+            rds_instances[rds_node] = t.add_resource(DBInstance(
+                "rds"+str(rds_node).zfill(2),
+                DBName="PlanPlus",
+                DBInstanceIdentifier=Join("",[resource_tag,"-",rds_name,"-",str(rds_node).zfill(2)]),
+                AllocatedStorage=rds_allocation_size[rds_node-1],
+                DBInstanceClass=rds_instance_type,
+                StorageType="gp2",
+                Engine="MySQL",
+                EngineVersion="5.7.19",
+                AutoMinorVersionUpgrade="false",
+                KmsKeyId=rds_master_key,
+                MasterUsername=Join("",["rdsgroup",str(rds_node),"master"]),
+                MasterUserPassword=rds_master_password,
+                StorageEncrypted="true",
+                DBParameterGroupName=rds_parameter_group,
+                DBSubnetGroupName=Ref(privateDbSubnetGroup),
+                VPCSecurityGroups=[Ref(rdsSecurityGroup)],
+                PubliclyAccessible="false",
+                MultiAZ="true",
+                BackupRetentionPeriod="35",
+                Tags=Tags(
+                    Name=Join("",[resource_tag,"-",rds_name,"-",str(rds_node).zfill(2)]),
+                    Environment=environment_name,
+                    Project=project_name,
+                    Ticket=ticket
+                    )   
+
+            ))
+
+        # Per-customer database endpoints, from the shard map
+        for cust in sorted(shards):
+            canonical_name = customers[cust]["canonical_name"]
+            rds_instance = rds_instances[shards[cust]]
+            db_endpoint = Join(":", [
+                GetAtt(rds_instance, "Endpoint.Address"),
+                GetAtt(rds_instance, "Endpoint.Port")
+            ])
+
+            t.add_resource(ssm.Parameter(
+                canonical_name + "DbEndpointParameter",
+                Name="/%s/%s/%s/db/endpoint" % (resource_tag, environment_name,
+                                                 cust),
+                Description="Database endpoint of %s" % cust,
+                Type="String",
+                Value=db_endpoint
+            ))
+
+            t.add_output(Output(
+                canonical_name + "DbEndpoint",
+                Description="Database endpoint of %s (%s)" % (
+                    cust, rds_instance.title),
+                Value=db_endpoint
+            ))
+
+    return t
+
+# Fleet rendering
+
+def render_variant(args):
+    spec, priorities, shards = args
+    return build_template(spec, priorities, shards).to_json()
+
+def render_fleet(base_file, overlay_groups, pool=None, only=None):
+    # Renders one template per combination of overlays, taking one file from
+    # each group (e.g. regions x environments). The base spec, the overlays and
+    # the listener priorities are loaded once here and shared by every variant;
+    # the templates themselves differ in nearly every resource, so each
+    # distinct variant is built in full, and variants that resolve to the same
+    # spec and shard map are only rendered once. They are rendered on pool when
+    # one is given, so a long-running caller such as --watch reuses its worker
+    # processes. When only is given, just the variants built from one of those
+    # overlay files are rendered.
+    base = load_spec(base_file)
+    overlays = {}
+    for group in overlay_groups:
+        for overlay_file in group:
+            overlays[overlay_file] = load_spec(overlay_file)
+
+    variants = {}
+    customers = set()
+    for combination in itertools.product(*overlay_groups):
+        spec = base
+        for overlay_file in combination:
+            spec = merge_spec(spec, overlays[overlay_file])
+        name = '-'.join(
+            os.path.splitext(os.path.basename(f))[0] for f in combination
+        )
+        if only is None or set(combination) & set(only):
+            variants[name] = spec
+        customers.update(spec["customers"])
+
+    priorities = allocate_listener_priorities(
+        customers, priorities_file_name(base_file)
+    )
+
+    variant_keys = {}
+    unique_work = {}
+    for name, spec in variants.items():
+        shards = allocate_db_shards(spec, shards_file_name(base_file))
+        key = json.dumps([spec, shards], sort_keys=True)
+        variant_keys[name] = key
+        unique_work.setdefault(key, (spec, priorities, shards))
+    keys = list(unique_work)
+    work = [unique_work[key] for key in keys]
+
+    if pool is not None and len(work) > 1:
+        rendered = pool.map(render_variant, work)
+    else:
+        rendered = [render_variant(w) for w in work]
+
+    by_key = dict(zip(keys, rendered))
+    return dict((name, by_key[key]) for name, key in variant_keys.items())
+
+# Watch mode
+
+def changed_files(file_names, interval=0.5):
+    # Yields the subset of file_names that changed, once per batch of changes.
+    # Uses inotify when inotify_simple is installed and polls modification
+    # times otherwise. Directories are watched rather than the files so that
+    # editors replacing a file on save are noticed too.
+    paths = dict((os.path.abspath(f), f) for f in file_names)
+    try:
+        from inotify_simple import INotify, flags
+    except ImportError:
+        INotify = None
+
+    if INotify is not None:
+        inotify = INotify()
+        watches = {}
+        for directory in set(os.path.dirname(path) for path in paths):
+            wd = inotify.add_watch(
+                directory, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+            )
+            watches[wd] = directory
+        while True:
+            changed = set()
+            # Collect the burst of events a single save produces
+            for event in inotify.read(read_delay=50):
+                path = os.path.join(watches[event.wd], event.name)
+                if path in paths:
+                    changed.add(paths[path])
+            if changed:
+                yield changed
+
+    def mtimes():
+        times = {}
+        for path in paths:
+            try:
+                times[path] = os.stat(path).st_mtime
+            except OSError:
+                times[path] = None
+        return times
+
+    last = mtimes()
+    while True:
+        time.sleep(interval)
+        current = mtimes()
+        changed = set(paths[path] for path in paths
+                      if current[path] != last[path])
+        last = current
+        if changed:
+            yield changed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate the VPC CloudFormation template from a spec file.'
+    )
+    parser.add_argument('spec', nargs='?', default='spec-prod.json',
+                        help='base spec file (default: spec-prod.json)')
+    parser.add_argument('-o', '--overlay', action='append', nargs='+',
+                        default=[], metavar='FILE',
+                        help='overlay files for one dimension, e.g. regions; '
+                             'repeat for more dimensions, every combination '
+                             'is rendered')
+    parser.add_argument('--out-dir', default='.',
+                        help='directory for rendered overlay variants')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of render processes (default: CPU count)')
+    parser.add_argument('--report', action='store_true',
+                        help='print a size and limits report to stderr')
+    parser.add_argument('--graph', action='store_true',
+                        help='print the resource dependency graph summary '
+                             'to stderr')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and re-render whenever the spec '
+                             'or an overlay file changes')
+    parser.add_argument('--out', default=None, metavar='FILE',
+                        help='write the template here instead of stdout '
+                             '(default with --watch: output.json)')
+    args = parser.parse_args()
+
+    def report(name, body):
+        if name and (args.report or args.graph):
+            sys.stderr.write('== %s\n' % name)
+        if args.report:
+            sys.stderr.write(template_report.format_report(
+                template_report.analyze(json.loads(body), body)) + '\n\n')
+        if args.graph:
+            template = json.loads(body)
+            sys.stderr.write(resource_graph.format_summary(
+                template, resource_graph.build_graph(template)) + '\n\n')
+
+    def render(only=None):
+        if not args.overlay:
+            spec = load_spec(args.spec)
+            priorities = allocate_listener_priorities(
+                spec["customers"], priorities_file_name(args.spec)
+            )
+            shards = allocate_db_shards(spec, shards_file_name(args.spec))
+            body = build_template(spec, priorities, shards).to_json()
+            out_file_name = args.out or ('output.json' if args.watch else None)
+            if out_file_name:
+                with open(out_file_name, 'w') as out_file:
+                    out_file.write(body + '\n')
+                print(out_file_name)
+            else:
+                print(body)
+            report(None, body)
+        else:
+            rendered = render_fleet(args.spec, args.overlay, pool, only)
+            if not os.path.isdir(args.out_dir):
+                os.makedirs(args.out_dir)
+            for name in sorted(rendered):
+                out_file_name = os.path.join(args.out_dir, name + '.json')
+                with open(out_file_name, 'w') as out_file:
+                    out_file.write(rendered[name] + '\n')
+                print(out_file_name)
+                report(name, rendered[name])
+
+    # One pool for the whole run, started before the first render so its
+    # workers are forked once
+    pool = None
+    if args.overlay and args.jobs != 1:
+        pool = multiprocessing.Pool(args.jobs)
+
+    if not args.watch:
+        try:
+            render()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    else:
+        # troposphere and the generator stay loaded between renders, so a
+        # change costs only the render itself
+        watched = [args.spec] + [f for group in args.overlay for f in group]
+        render()
+        sys.stdout.flush()
+        for changed in changed_files(watched):
+            only = None if args.spec in changed else changed
+            start = time.time()
+            try:
+                render(only)
+            except Exception as e:
+                # Keep watching through half-saved or invalid specs
+                sys.stderr.write('Render failed: %s\n' % e)
+            else:
+                sys.stderr.write('Rendered %s in %d ms\n' % (
+                    ', '.join(sorted(changed)), (time.time() - start) * 1000))
+            sys.stdout.flush()
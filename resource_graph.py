@@ -0,0 +1,405 @@
+from collections import defaultdict
+
+import argparse
+import json
+import re
+import sys
+
+# Resource dependency graph of a rendered CloudFormation template.
+# CloudFormation creates every resource whose Ref, Fn::GetAtt, Fn::Sub and
+# DependsOn targets exist, so the path through this graph that takes longest,
+# weighting every resource by how long its type typically takes to create,
+# bounds how fast the stack can be created.
+
+SUB_REFERENCE = re.compile(r'\$\{([A-Za-z0-9]+)(?:\.[^}]*)?\}')
+
+# Seconds as (fastest, typical, slowest). Deleting takes
+# FALLBACK_DELETE_DURATION unless a 'delete' range is given.
+DEFAULT_DURATIONS = {
+    'AWS::AutoScaling::AutoScalingGroup': {'create': (60, 120, 300),
+                                           'update': (10, 30, 120),
+                                           'delete': (60, 180, 420)},
+    'AWS::AutoScaling::LaunchConfiguration': {'create': (2, 5, 10)},
+    'AWS::AutoScaling::ScalingPolicy': {'create': (2, 5, 10)},
+    'AWS::AutoScaling::ScheduledAction': {'create': (2, 5, 10)},
+    # A nested stack of moderate size; override it per stack with the
+    # estimate of the nested template
+    'AWS::CloudFormation::Stack': {'create': (60, 300, 900),
+                                   'delete': (60, 180, 600)},
+    'AWS::CloudWatch::Alarm': {'create': (2, 5, 10)},
+    'AWS::EC2::EIP': {'create': (5, 10, 20)},
+    'AWS::EC2::FlowLog': {'create': (5, 10, 20)},
+    'AWS::EC2::Instance': {'create': (30, 60, 180)},
+    'AWS::EC2::InternetGateway': {'create': (10, 15, 30)},
+    'AWS::EC2::LaunchTemplate': {'create': (2, 5, 10)},
+    'AWS::EC2::NatGateway': {'create': (90, 120, 240),
+                             'delete': (30, 60, 120)},
+    'AWS::EC2::PlacementGroup': {'create': (5, 10, 20)},
+    'AWS::EC2::Route': {'create': (5, 10, 30)},
+    'AWS::EC2::RouteTable': {'create': (5, 10, 15)},
+    'AWS::EC2::SecurityGroup': {'create': (5, 10, 20)},
+    'AWS::EC2::SecurityGroupIngress': {'create': (2, 5, 10)},
+    'AWS::EC2::Subnet': {'create': (5, 10, 20)},
+    'AWS::EC2::SubnetRouteTableAssociation': {'create': (5, 10, 15)},
+    'AWS::EC2::VPC': {'create': (10, 15, 30)},
+    'AWS::EC2::VPCGatewayAttachment': {'create': (10, 15, 30)},
+    'AWS::ElasticLoadBalancingV2::Listener': {'create': (2, 5, 10)},
+    'AWS::ElasticLoadBalancingV2::ListenerRule': {'create': (1, 3, 5)},
+    'AWS::ElasticLoadBalancingV2::LoadBalancer': {'create': (120, 180, 300),
+                                                  'update': (5, 15, 60)},
+    'AWS::ElasticLoadBalancingV2::TargetGroup': {'create': (5, 10, 20)},
+    'AWS::IAM::InstanceProfile': {'create': (60, 120, 180)},
+    'AWS::IAM::Role': {'create': (5, 15, 30)},
+    'AWS::RDS::DBInstance': {'create': (600, 900, 1500),
+                             'update': (300, 900, 1800),
+                             'delete': (300, 600, 900)},
+    'AWS::RDS::DBSubnetGroup': {'create': (5, 10, 20)},
+    'AWS::S3::Bucket': {'create': (20, 25, 60)},
+    'AWS::SSM::Parameter': {'create': (2, 5, 10)},
+}
+FALLBACK_DURATION = (5, 15, 60)
+FALLBACK_DELETE_DURATION = (1, 5, 15)
+
+# Inline rules of a security group that name another group of the template,
+# as (rule list property, group property, resource type of a separate rule).
+# Each makes the group wait for the other although the rule could be a
+# resource of its own.
+INLINE_GROUP_RULES = (
+    ('SecurityGroupIngress', 'SourceSecurityGroupId',
+     'AWS::EC2::SecurityGroupIngress'),
+    ('SecurityGroupEgress', 'DestinationSecurityGroupId',
+     'AWS::EC2::SecurityGroupEgress'),
+)
+
+
+def depends_on(resource):
+    value = resource.get('DependsOn', [])
+    if not isinstance(value, list):
+        value = [value]
+    return set(value)
+
+
+def references(value, found):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == 'Ref':
+                found.add(item)
+            elif key == 'Fn::GetAtt':
+                if isinstance(item, list):
+                    found.add(item[0])
+                else:
+                    found.add(item.split('.')[0])
+            elif key == 'Fn::Sub':
+                text = item[0] if isinstance(item, list) else item
+                found.update(SUB_REFERENCE.findall(text))
+                if isinstance(item, list):
+                    references(item[1], found)
+            else:
+                references(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            references(item, found)
+    return found
+
+
+def build_graph(template):
+    # Maps every resource to the resources it waits for. Parameters and
+    # pseudo parameters are not resources and are left out.
+    resources = template.get('Resources', {})
+    graph = {}
+    for name, resource in resources.items():
+        found = references(resource.get('Properties', {}), set())
+        found.update(depends_on(resource))
+        graph[name] = set(dep for dep in found if dep in resources)
+    return graph
+
+
+def duration_range(durations, resource_type, action):
+    entry = durations.get(resource_type, {})
+    if action == 'delete':
+        return entry.get('delete') or FALLBACK_DELETE_DURATION
+    return entry.get(action) or entry.get('create') or FALLBACK_DURATION
+
+
+def typical_durations(template, durations=None):
+    # Typical create time of every resource, in seconds
+    if durations is None:
+        durations = DEFAULT_DURATIONS
+    return dict(
+        (name, float(duration_range(durations, resource['Type'], 'create')[1]))
+        for name, resource in template.get('Resources', {}).items()
+    )
+
+
+def topological_order(graph):
+    waiting = dict((name, len(deps)) for name, deps in graph.items())
+    dependents = defaultdict(list)
+    for name, deps in graph.items():
+        for dep in deps:
+            dependents[dep].append(name)
+
+    ready = sorted(name for name, count in waiting.items() if count == 0)
+    order = []
+    while ready:
+        name = ready.pop()
+        order.append(name)
+        for dependent in dependents[name]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+
+    if len(order) != len(graph):
+        cycle = sorted(name for name, count in waiting.items() if count)
+        raise ValueError('Circular dependency between %s' % ', '.join(cycle))
+    return order
+
+
+def levels(graph):
+    # Level of a resource is the number of resources on the longest chain it
+    # has to wait for.
+    level = {}
+    for name in topological_order(graph):
+        level[name] = max([level[dep] + 1 for dep in graph[name]] or [0])
+    return level
+
+
+def critical_path(graph, durations=None):
+    # Longest path through the graph, weighting each resource by its duration
+    # (1 per resource when no durations are given). Returns the total weight
+    # and the path from the first resource created to the last.
+    finish = {}
+    previous = {}
+    for name in topological_order(graph):
+        start = 0
+        for dep in sorted(graph[name]):
+            if finish[dep] > start:
+                start = finish[dep]
+                previous[name] = dep
+        finish[name] = start + (durations[name] if durations else 1)
+
+    if not finish:
+        return 0, []
+    name = max(sorted(finish), key=lambda n: finish[n])
+    total = finish[name]
+    path = [name]
+    while path[-1] in previous:
+        path.append(previous[path[-1]])
+    return total, list(reversed(path))
+
+
+def reachable(graph, start, skip_edge=None):
+    seen = set()
+    pending = [start]
+    while pending:
+        name = pending.pop()
+        for dep in graph[name]:
+            if (name, dep) == skip_edge or dep in seen:
+                continue
+            seen.add(dep)
+            pending.append(dep)
+    return seen
+
+
+def breakable_edges(template):
+    # Edges that only exist because a security group lists a rule for another
+    # group of the template inline. Moving the rule into its own
+    # SecurityGroupIngress/SecurityGroupEgress resource lets both groups be
+    # created at once. Maps (group, other group) to the resource type the
+    # rule would become.
+    resources = template.get('Resources', {})
+    breakable = {}
+    for name, resource in resources.items():
+        if resource['Type'] != 'AWS::EC2::SecurityGroup':
+            continue
+        properties = resource.get('Properties', {})
+        rule_targets = {}
+        for rules_property, group_property, rule_type in INLINE_GROUP_RULES:
+            for rule in properties.get(rules_property, []):
+                for dep in references(rule.get(group_property), set()):
+                    if dep in resources:
+                        rule_targets[dep] = rule_type
+        other = dict((key, value) for key, value in properties.items()
+                     if key not in [rules for rules, _, _ in INLINE_GROUP_RULES])
+        # The edge stays when anything else references the group as well
+        kept = references(other, set()) | depends_on(resource)
+        for dep, rule_type in rule_targets.items():
+            if dep not in kept:
+                breakable[(name, dep)] = rule_type
+    return breakable
+
+
+def without_edges(graph, edges):
+    return dict((name, set(dep for dep in deps if (name, dep) not in edges))
+                for name, deps in graph.items())
+
+
+def redundant_depends_on(template, graph):
+    # DependsOn entries already implied by another chain of references only
+    # add noise; DependsOn entries that are the sole reason for an edge are
+    # kept.
+    redundant = []
+    for name, resource in sorted(template.get('Resources', {}).items()):
+        for dep in sorted(depends_on(resource)):
+            if dep in graph and dep in reachable(graph, name, (name, dep)):
+                redundant.append((name, dep))
+    return redundant
+
+
+def required_depends_on(template):
+    # Dependencies CloudFormation cannot infer from references:
+    # - a route through an internet gateway fails until the gateway is
+    #   attached to the VPC
+    # - a VPC Elastic IP needs the internet gateway attachment when both are
+    #   in the same template
+    resources = template.get('Resources', {})
+    attachments = {}
+    for name, resource in resources.items():
+        if resource['Type'] == 'AWS::EC2::VPCGatewayAttachment':
+            gateway = resource.get('Properties', {}).get('InternetGatewayId')
+            if isinstance(gateway, dict) and 'Ref' in gateway:
+                attachments[gateway['Ref']] = name
+
+    required = []
+    for name, resource in sorted(resources.items()):
+        properties = resource.get('Properties', {})
+        if resource['Type'] == 'AWS::EC2::Route':
+            gateway = properties.get('GatewayId')
+            if isinstance(gateway, dict) and gateway.get('Ref') in attachments:
+                required.append((name, attachments[gateway['Ref']]))
+        elif (resource['Type'] == 'AWS::EC2::EIP' and
+                properties.get('Domain') == 'vpc'):
+            for attachment in sorted(attachments.values()):
+                required.append((name, attachment))
+    return required
+
+
+def missing_depends_on(template, graph):
+    return [(name, dep) for name, dep in required_depends_on(template)
+            if dep not in reachable(graph, name)]
+
+
+def to_dot(template, graph, highlight=()):
+    resources = template.get('Resources', {})
+    highlight_edges = set(zip(highlight[1:], highlight[:-1]))
+    lines = ['digraph resources {', '    rankdir=LR;',
+             '    node [shape=box, fontsize=10];']
+    for name in sorted(graph):
+        attributes = 'label="%s\\n%s"' % (name, resources[name]['Type'])
+        if name in highlight:
+            attributes += ', color=red'
+        lines.append('    "%s" [%s];' % (name, attributes))
+    for name in sorted(graph):
+        explicit = depends_on(resources[name])
+        for dep in sorted(graph[name]):
+            attributes = []
+            if dep in explicit:
+                attributes.append('style=dashed')
+            if (name, dep) in highlight_edges:
+                attributes.append('color=red')
+            lines.append('    "%s" -> "%s"%s;' % (
+                dep, name,
+                ' [%s]' % ', '.join(attributes) if attributes else ''))
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def to_json(template, graph, durations=None):
+    resources = template.get('Resources', {})
+    level = levels(graph)
+    depth, chain = critical_path(graph)
+    seconds, path = critical_path(graph,
+                                  typical_durations(template, durations))
+    return json.dumps({
+        'resources': dict(
+            (name, {
+                'type': resources[name]['Type'],
+                'level': level[name],
+                'depends_on': sorted(graph[name]),
+                'explicit': sorted(depends_on(resources[name])),
+            }) for name in graph
+        ),
+        'depth': depth,
+        'longest_chain': chain,
+        'critical_path': path,
+        'critical_path_seconds': seconds,
+        'breakable': sorted(
+            [name, dep, rule_type]
+            for (name, dep), rule_type in breakable_edges(template).items()
+        ),
+    }, indent=4, sort_keys=True, separators=(',', ': '))
+
+
+def format_summary(template, graph, durations=None):
+    level = levels(graph)
+    width = defaultdict(int)
+    for name in level:
+        width[level[name]] += 1
+    depth, chain = critical_path(graph)
+    typical = typical_durations(template, durations)
+    seconds, path = critical_path(graph, typical)
+
+    lines = []
+    lines.append('Resources %d, dependencies %d, explicit DependsOn %d' % (
+        len(graph), sum(len(deps) for deps in graph.values()),
+        sum(len(depends_on(resource))
+            for resource in template.get('Resources', {}).values())))
+    lines.append('Depth: %d (resources per level: %s)' % (
+        depth, ', '.join(str(width[i]) for i in sorted(width))))
+    lines.append('Longest chain: ' + ' -> '.join(chain))
+    lines.append('Critical path (typically %ds): %s' % (
+        seconds, ' -> '.join(path)))
+
+    # Serial chains on the critical path that could be created in parallel
+    breakable = breakable_edges(template)
+    on_path = [(name, dep) for dep, name in zip(path, path[1:])
+               if (name, dep) in breakable]
+    for name, dep in on_path:
+        lines.append('Breakable chain on the critical path: %s waits for %s '
+                     'only for an inline rule; a separate %s would let both '
+                     'be created at once' % (name, dep, breakable[(name, dep)]))
+    if on_path:
+        shorter, _ = critical_path(without_edges(graph, breakable), typical)
+        lines.append('Breaking the inline security group rules shortens the '
+                     'critical path to %ds' % shorter)
+
+    for name, dep in redundant_depends_on(template, graph):
+        lines.append('Redundant DependsOn: %s -> %s is already implied'
+                     % (name, dep))
+    explicit_on_path = [
+        (name, dep) for dep, name in zip(path, path[1:])
+        if dep in depends_on(template['Resources'][name])
+    ]
+    for name, dep in explicit_on_path:
+        lines.append('DependsOn on the critical path: %s -> %s' % (name, dep))
+    for name, dep in missing_depends_on(template, graph):
+        lines.append('Missing DependsOn: %s -> %s' % (name, dep))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Report and export the resource dependency graph of a '
+                    'rendered template.'
+    )
+    parser.add_argument('template', help='rendered template JSON, '
+                                         'e.g. output.json')
+    parser.add_argument('--dot', metavar='FILE',
+                        help='write the graph in Graphviz DOT format')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the graph as JSON')
+    args = parser.parse_args()
+
+    with open(args.template) as template_file:
+        template = json.load(template_file)
+    graph = build_graph(template)
+
+    if args.dot:
+        with open(args.dot, 'w') as dot_file:
+            dot_file.write(to_dot(template, graph, critical_path(
+                graph, typical_durations(template))[1]) + '\n')
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json_file.write(to_json(template, graph) + '\n')
+    print(format_summary(template, graph))
+    if missing_depends_on(template, graph):
+        sys.exit(1)
@@ -0,0 +1,212 @@
+from collections import defaultdict
+
+import argparse
+import itertools
+import os
+import sys
+
+from generate_vpc import load_spec, merge_spec, spec_region, vpc_cidr_range
+
+# Fleet-wide index of specs that finds the collisions CloudFormation would
+# only report at deploy time: overlapping VPC CIDRs between environments that
+# may be peered, duplicate customer ports within a stack, and ALB, target
+# group, RDS and SSM names that clash within a region or exceed their length
+# limit. Every spec is read once; names and ports go into hash maps and CIDRs
+# into an interval tree, so thousands of specs are checked in one pass.
+
+ELB_NAME_LIMIT = 32
+DB_INSTANCE_IDENTIFIER_LIMIT = 63
+
+
+class IntervalTree(object):
+    # Static interval tree: a balanced binary tree over the intervals sorted
+    # by start, kept in a list, where every node also records the largest end
+    # in its subtree so whole subtrees that end before a query are skipped.
+
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals)
+        self.max_end = [None] * len(self.intervals)
+        self._build(0, len(self.intervals))
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        max_end = self.intervals[mid][1]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > max_end:
+                max_end = child
+        self.max_end[mid] = max_end
+        return max_end
+
+    def overlapping(self, start, end):
+        # Yields every (start, end, item) intersecting [start, end]
+        pending = [(0, len(self.intervals))]
+        while pending:
+            lo, hi = pending.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.max_end[mid] < start:
+                continue
+            pending.append((lo, mid))
+            interval = self.intervals[mid]
+            if interval[0] <= end:
+                if interval[1] >= start:
+                    yield interval
+                pending.append((mid + 1, hi))
+
+
+def spec_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.endswith('.json'):
+                        yield os.path.join(directory, name)
+        else:
+            yield path
+
+
+def spec_names(spec):
+    # Region-scoped names the generator gives to the stack's resources, as
+    # (kind, name, length limit) tuples
+    tag = spec["project"]["tag"]
+    names = [
+        ('load balancer', tag + "-ALB", ELB_NAME_LIMIT),
+        ('target group', tag + "-default", ELB_NAME_LIMIT),
+    ]
+    for cust in spec["customers"]:
+        names.append(('target group', "%s-%s-webLayer" % (tag, cust),
+                      ELB_NAME_LIMIT))
+        names.append(('target group', "%s-%s-apiLayer" % (tag, cust),
+                      ELB_NAME_LIMIT))
+    if spec["rds"]:
+        rds_name = spec["rds"]["canonical_name"]
+        for node in range(1, int(spec["rds"]["num_nodes"]) + 1):
+            names.append(('RDS instance',
+                          "%s-%s-%s" % (tag, rds_name, str(node).zfill(2)),
+                          DB_INSTANCE_IDENTIFIER_LIMIT))
+        for cust in spec["customers"]:
+            names.append(('SSM parameter', "/%s/%s/%s/db/endpoint" % (
+                tag, spec["project"]["env"], cust), None))
+    return names
+
+
+class SpecIndex(object):
+
+    def __init__(self):
+        self.names = defaultdict(list)
+        self.cidrs = defaultdict(list)
+        self.problems = []
+        self.count = 0
+
+    def add(self, label, spec):
+        self.count += 1
+        region = spec_region(spec)
+
+        for kind, name, limit in spec_names(spec):
+            # Load balancer, target group and RDS names are case-insensitive
+            key = name
+            if limit in (ELB_NAME_LIMIT, DB_INSTANCE_IDENTIFIER_LIMIT):
+                key = name.lower()
+            self.names[(region, kind, key)].append((label, name))
+            if limit and len(name) > limit:
+                self.problems.append('%s name %s in %s is %d characters, '
+                                     'the limit is %d'
+                                     % (kind, name, label, len(name), limit))
+
+        ports = defaultdict(list)
+        for cust, customer in spec["customers"].items():
+            ports[str(customer["port"])].append(cust)
+        for port, customers in sorted(ports.items()):
+            if len(customers) > 1:
+                self.problems.append('port %s is used by %s in %s'
+                                     % (port, ', '.join(sorted(customers)),
+                                        label))
+
+        cidr = spec["project"].get("vpc_cidr", "10.0.0.0/16")
+        try:
+            start, end = vpc_cidr_range(cidr)
+        except ValueError as e:
+            self.problems.append('%s in %s' % (e, label))
+            return
+        # Only VPCs that may be peered have to be disjoint; specs outside any
+        # peering group would otherwise all clash on the default CIDR
+        group = spec["project"].get("peering_group")
+        if group is not None:
+            self.cidrs[group].append((start, end, (label, cidr)))
+
+    def conflicts(self):
+        problems = list(self.problems)
+
+        for (region, kind, _), owners in sorted(self.names.items()):
+            if len(owners) > 1:
+                problems.append('%s name %s is used in %s by %s' % (
+                    kind, owners[0][1], region,
+                    ', '.join(sorted(label for label, _ in owners))))
+
+        for group, intervals in sorted(self.cidrs.items()):
+            tree = IntervalTree(intervals)
+            for start, end, (label, cidr) in tree.intervals:
+                for other in tree.overlapping(start, end):
+                    other_label, other_cidr = other[2]
+                    # Report each pair once
+                    if (other[0], other[1], other_label) <= \
+                            (start, end, label):
+                        continue
+                    problems.append('VPC CIDR %s of %s overlaps %s of %s '
+                                    '(peering group %s)' % (
+                                        cidr, label, other_cidr, other_label,
+                                        group))
+        return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Index every spec and report conflicts between them '
+                    'before anything is deployed.'
+    )
+    parser.add_argument('specs', nargs='+', metavar='SPEC',
+                        help='spec files or directories of spec files')
+    parser.add_argument('-o', '--overlay', action='append', nargs='+',
+                        default=[], metavar='FILE',
+                        help='overlay files as for generate_vpc.py; every '
+                             'spec is indexed in every combination')
+    args = parser.parse_args()
+
+    overlays = {}
+    for group in args.overlay:
+        for overlay_file in group:
+            overlays[overlay_file] = load_spec(overlay_file)
+
+    index = SpecIndex()
+    for file_name in spec_files(args.specs):
+        try:
+            base = load_spec(file_name)
+        except ValueError as e:
+            index.problems.append('%s is not valid JSON: %s' % (file_name, e))
+            continue
+        # Priority/shard allocation files and overlays may sit next to the
+        # specs
+        if not isinstance(base, dict) or \
+                "project" not in base or "customers" not in base:
+            continue
+        for combination in itertools.product(*args.overlay):
+            spec = base
+            for overlay_file in combination:
+                spec = merge_spec(spec, overlays[overlay_file])
+            label = file_name
+            if combination:
+                label += '[%s]' % '-'.join(
+                    os.path.splitext(os.path.basename(f))[0]
+                    for f in combination)
+            index.add(label, spec)
+
+    problems = index.conflicts()
+    for problem in problems:
+        print(problem)
+    sys.stderr.write('%d specs indexed, %d conflicts\n'
+                     % (index.count, len(problems)))
+    if problems:
+        sys.exit(1)
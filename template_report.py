@@ -0,0 +1,230 @@
+from collections import defaultdict
+
+import argparse
+import json
+
+# Size and limits report for rendered CloudFormation templates. Works on the
+# template generate_vpc.py renders as well as on any saved JSON render such as
+# output.json.
+
+# Warn once a count reaches this share of its limit
+WARN_RATIO = 0.8
+
+# CloudFormation template limits
+TEMPLATE_BODY_LIMIT = 51200          # bytes, TemplateBody passed inline
+TEMPLATE_S3_LIMIT = 1024 * 1024      # bytes, TemplateURL
+RESOURCE_LIMIT = 500
+PARAMETER_LIMIT = 200
+OUTPUT_LIMIT = 200
+MAPPING_LIMIT = 200
+DESCRIPTION_LIMIT = 1024             # characters
+
+# Elastic Load Balancing (ALB) limits
+RULES_PER_LOAD_BALANCER_LIMIT = 100  # excluding the default rules
+LISTENERS_PER_LOAD_BALANCER_LIMIT = 50
+TARGET_GROUPS_PER_LOAD_BALANCER_LIMIT = 100
+CERTIFICATES_PER_LOAD_BALANCER_LIMIT = 25
+CONDITION_VALUES_PER_RULE_LIMIT = 5
+ELB_NAME_LIMIT = 32                  # load balancer and target group names
+
+
+def load_template(file_name):
+    with open(file_name) as template_file:
+        body = template_file.read()
+    return json.loads(body), body
+
+
+def compact_size(value):
+    return len(json.dumps(value, separators=(',', ':'), sort_keys=True))
+
+
+def ref_target(value):
+    if isinstance(value, dict) and list(value) == ['Ref']:
+        return value['Ref']
+    return None
+
+
+def literal_name(value):
+    # Names are either plain strings or Fn::Join of plain strings, anything
+    # else can only be resolved at deploy time.
+    if isinstance(value, dict) and list(value) == ['Fn::Join']:
+        delimiter, parts = value['Fn::Join']
+        if not any(isinstance(part, dict) for part in parts):
+            return delimiter.join(parts)
+        return None
+    if isinstance(value, dict):
+        return None
+    return value
+
+
+def check(name, count, limit, warnings):
+    if count > limit:
+        warnings.append('%s: %d exceeds the limit of %d' % (name, count, limit))
+    elif count >= WARN_RATIO * limit:
+        warnings.append('%s: %d is within %d%% of the limit of %d'
+                        % (name, count, 100 - int(WARN_RATIO * 100), limit))
+
+
+def analyze(template, body=None):
+    if body is None:
+        body = json.dumps(template, indent=4, sort_keys=True)
+
+    resources = template.get('Resources', {})
+    warnings = []
+
+    resource_bytes = dict(
+        (name, compact_size(resource)) for name, resource in resources.items()
+    )
+    type_bytes = defaultdict(int)
+    type_counts = defaultdict(int)
+    for name, resource in resources.items():
+        type_bytes[resource['Type']] += resource_bytes[name]
+        type_counts[resource['Type']] += 1
+
+    counts = {
+        'Resources': len(resources),
+        'Parameters': len(template.get('Parameters', {})),
+        'Outputs': len(template.get('Outputs', {})),
+        'Mappings': len(template.get('Mappings', {})),
+    }
+
+    body_bytes = len(body.encode('utf-8'))
+    compact_bytes = compact_size(template)
+    check('Template body bytes', body_bytes, TEMPLATE_BODY_LIMIT, warnings)
+    if body_bytes > TEMPLATE_BODY_LIMIT and compact_bytes <= TEMPLATE_BODY_LIMIT:
+        warnings.append('Template body fits the inline limit once minified '
+                        '(%d bytes)' % compact_bytes)
+    check('Template bytes (S3)', compact_bytes, TEMPLATE_S3_LIMIT, warnings)
+    check('Resources', counts['Resources'], RESOURCE_LIMIT, warnings)
+    check('Parameters', counts['Parameters'], PARAMETER_LIMIT, warnings)
+    check('Outputs', counts['Outputs'], OUTPUT_LIMIT, warnings)
+    check('Mappings', counts['Mappings'], MAPPING_LIMIT, warnings)
+    check('Description length', len(template.get('Description', '')),
+          DESCRIPTION_LIMIT, warnings)
+
+    # Listeners and rules, grouped by the load balancer they belong to
+    listener_rules = defaultdict(list)
+    load_balancer_listeners = defaultdict(list)
+    load_balancer_target_groups = defaultdict(set)
+    load_balancer_certificates = defaultdict(int)
+    listener_load_balancer = {}
+
+    for name, resource in resources.items():
+        properties = resource.get('Properties', {})
+        if resource['Type'] == 'AWS::ElasticLoadBalancingV2::Listener':
+            load_balancer = ref_target(properties.get('LoadBalancerArn'))
+            listener_load_balancer[name] = load_balancer
+            load_balancer_listeners[load_balancer].append(name)
+            load_balancer_certificates[load_balancer] += len(
+                properties.get('Certificates', []))
+            for action in properties.get('DefaultActions', []):
+                target_group = ref_target(action.get('TargetGroupArn'))
+                if target_group:
+                    load_balancer_target_groups[load_balancer].add(target_group)
+        elif resource['Type'] == 'AWS::ElasticLoadBalancingV2::ListenerRule':
+            listener_rules[ref_target(properties.get('ListenerArn'))].append(name)
+            values = sum(len(condition.get('Values', []))
+                          for condition in properties.get('Conditions', []))
+            check('Condition values in %s' % name, values,
+                  CONDITION_VALUES_PER_RULE_LIMIT, warnings)
+        if resource['Type'] in ('AWS::ElasticLoadBalancingV2::LoadBalancer',
+                                'AWS::ElasticLoadBalancingV2::TargetGroup'):
+            elb_name = literal_name(properties.get('Name'))
+            if elb_name is not None:
+                check('Name length of %s' % name, len(elb_name),
+                      ELB_NAME_LIMIT, warnings)
+
+    load_balancer_rules = defaultdict(int)
+    for listener, rules in listener_rules.items():
+        load_balancer = listener_load_balancer.get(listener)
+        load_balancer_rules[load_balancer] += len(rules)
+        for rule in rules:
+            for action in resources[rule]['Properties'].get('Actions', []):
+                target_group = ref_target(action.get('TargetGroupArn'))
+                if target_group:
+                    load_balancer_target_groups[load_balancer].add(target_group)
+
+    for load_balancer in sorted(load_balancer_listeners, key=str):
+        check('Rules on %s' % load_balancer, load_balancer_rules[load_balancer],
+              RULES_PER_LOAD_BALANCER_LIMIT, warnings)
+        check('Listeners on %s' % load_balancer,
+              len(load_balancer_listeners[load_balancer]),
+              LISTENERS_PER_LOAD_BALANCER_LIMIT, warnings)
+        check('Target groups on %s' % load_balancer,
+              len(load_balancer_target_groups[load_balancer]),
+              TARGET_GROUPS_PER_LOAD_BALANCER_LIMIT, warnings)
+        check('Certificates on %s' % load_balancer,
+              load_balancer_certificates[load_balancer],
+              CERTIFICATES_PER_LOAD_BALANCER_LIMIT, warnings)
+
+    return {
+        'body_bytes': body_bytes,
+        'compact_bytes': compact_bytes,
+        'counts': counts,
+        'resource_bytes': resource_bytes,
+        'type_bytes': dict(type_bytes),
+        'type_counts': dict(type_counts),
+        'listener_rules': dict(
+            (listener, len(rules)) for listener, rules in listener_rules.items()
+        ),
+        'warnings': warnings,
+    }
+
+
+def format_report(report, top=10):
+    lines = []
+    lines.append('Template: %d bytes (%d minified)'
+                 % (report['body_bytes'], report['compact_bytes']))
+    lines.append('Counts: ' + ', '.join(
+        '%s %d' % (key, report['counts'][key])
+        for key in ('Resources', 'Parameters', 'Outputs', 'Mappings')))
+
+    total = float(report['compact_bytes']) or 1.0
+    lines.append('')
+    lines.append('Bytes per resource type:')
+    for resource_type, size in sorted(report['type_bytes'].items(),
+                                      key=lambda item: (-item[1], item[0])):
+        lines.append('  %7d %5.1f%% %4dx %s' % (
+            size, 100 * size / total, report['type_counts'][resource_type],
+            resource_type))
+
+    lines.append('')
+    lines.append('Largest resources:')
+    largest = sorted(report['resource_bytes'].items(),
+                     key=lambda item: (-item[1], item[0]))
+    for name, size in largest[:top]:
+        lines.append('  %7d %5.1f%% %s' % (size, 100 * size / total, name))
+
+    lines.append('')
+    lines.append('Rules per listener:')
+    for listener, rules in sorted(report['listener_rules'].items(),
+                                  key=lambda item: str(item[0])):
+        lines.append('  %7d %s' % (rules, listener))
+
+    lines.append('')
+    if report['warnings']:
+        lines.append('Warnings:')
+        lines.extend('  ' + warning for warning in report['warnings'])
+    else:
+        lines.append('No limits within %d%% of being reached.'
+                     % (100 - int(WARN_RATIO * 100)))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Report size and service limits of rendered templates.'
+    )
+    parser.add_argument('templates', nargs='+', metavar='TEMPLATE',
+                        help='rendered template JSON, e.g. output.json')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of largest resources to list')
+    args = parser.parse_args()
+
+    for i, file_name in enumerate(args.templates):
+        if i:
+            print('')
+        template, body = load_template(file_name)
+        if len(args.templates) > 1:
+            print('== %s' % file_name)
+        print(format_report(analyze(template, body), args.top))